@@ -25,6 +25,9 @@ SECRET_KEY = "django-insecure-=ee!3!s+-+k09bs#uisi7u!p(o#1c0(^2b0!-1puvqpeil&603
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# Clients allowed to read /api/metrics/ when DEBUG is off
+INTERNAL_IPS = ["127.0.0.1"]
+
 ALLOWED_HOSTS = []
 
 
@@ -43,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "portfolio.middleware.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -84,6 +88,20 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# File based so the web server and the upload worker share the price matrix
+# and the metadata. Entries may be culled, the versions that key them are
+# DataVersion rows in the database
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache",
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -120,6 +138,10 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Uploaded workbooks waiting for the upload worker
+
+MEDIA_ROOT = BASE_DIR / "media"
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
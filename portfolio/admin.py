@@ -1,9 +1,23 @@
 from django.contrib import admin
 
-from .models import Asset, Portfolio, Price, Tick, Transaction
+from .models import (
+    Asset,
+    Portfolio,
+    PortfolioSnapshot,
+    Position,
+    Price,
+    Tick,
+    Transaction,
+    UploadDigest,
+    UploadJob,
+)
 
 admin.site.register(Asset)
 admin.site.register(Portfolio)
+admin.site.register(PortfolioSnapshot)
+admin.site.register(Position)
 admin.site.register(Price)
 admin.site.register(Tick)
 admin.site.register(Transaction)
+admin.site.register(UploadDigest)
+admin.site.register(UploadJob)
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class PortfolioConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "portfolio"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from .common import install_sql_wrapper
+
+        connection_created.connect(install_sql_wrapper)
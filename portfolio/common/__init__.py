@@ -1,3 +1,85 @@
+from .charts import ChartCache, cached_comparation_plot, chart_cache
+from .digests import (
+    WORKBOOK_KEY,
+    DigestKey,
+    column_digests,
+    file_digest,
+    load_digests,
+    save_digests,
+    stored_file_digest,
+)
+from .excel import EXCEL_CHUNK_ROWS, concat_chunks, open_workbook, read_sheet
+from .fixedpoint import (
+    PRICE_DECIMALS,
+    QUANTITY_DECIMALS,
+    VALUATION_MODES,
+    VALUE_DECIMALS,
+    decimal_places,
+    fixed_holdings,
+    fixed_values,
+    from_fixed,
+    round_scaled,
+    to_fixed,
+    valuation_mode,
+    value_holdings,
+)
+from .metadata import Metadata, PortfolioSummary, get_metadata
+from .metrics import (
+    MetricsRegistry,
+    RequestMetrics,
+    current_metrics,
+    install_sql_wrapper,
+    registry,
+    timed,
+)
+from .parallel import (
+    PROCESS_WORKERS,
+    SHARD_DAYS,
+    compute_many,
+    get_process_pool,
+    shared_prices,
+    value_shard,
+)
+from .positions import (
+    QUANTITY_STEP,
+    PositionLedger,
+    held_quantity,
+    rebuild_positions,
+    record_transactions,
+)
+from .prices import (
+    PriceMatrix,
+    get_price_matrix,
+    invalidate_price_matrix,
+    renumber_trading_days,
+)
+from .resample import (
+    CHART_POINTS,
+    RESOLUTIONS,
+    Resolution,
+    lttb_indices,
+    parse_resolution,
+    resample_series,
+    trading_day_indices,
+)
+from .snapshots import (
+    bump_snapshot_version,
+    get_snapshot_version,
+    load_snapshot_series,
+    load_snapshot_series_many,
+    refresh_snapshots,
+)
+from .synthetic import append_price_days, build_workbook, create_transactions
+from .timeseries import (
+    PortfolioSeries,
+    compute_portfolio_series,
+    empty_quantity_deltas,
+    load_initial_quantities,
+    load_initial_quantities_many,
+    load_price_frame,
+    load_quantity_deltas,
+    load_quantity_deltas_many,
+)
 from .utils import (
     calculate_actives_cuantity,
     calculate_portfolio_value,
@@ -5,3 +87,5 @@ from .utils import (
     comparation_plot,
     get_minmax_range,
 )
+from .versions import bump_version, get_version, get_versions
+from .workers import executor, run_in_worker
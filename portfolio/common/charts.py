@@ -0,0 +1,82 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+
+from django.conf import settings
+
+from .resample import Resolution, resample_series
+from .snapshots import get_snapshot_version
+from .timeseries import PortfolioSeries
+from .utils import comparation_plot
+
+Plots = Tuple[str, str]
+
+
+class ChartCache:
+    """
+    Rendered plots kept in memory, least recently used first out once the
+    total size of the HTML goes over max_bytes.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: "OrderedDict[Hashable, Plots]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _entry_size(self, plots: Plots) -> int:
+        return sum(len(plot) for plot in plots)
+
+    def get(self, key: Hashable) -> Optional[Plots]:
+        with self.lock:
+            plots = self.entries.get(key)
+            if plots is not None:
+                self.entries.move_to_end(key)
+            return plots
+
+    def set(self, key: Hashable, plots: Plots) -> None:
+        size = self._entry_size(plots)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self._entry_size(self.entries.pop(key))
+            self.entries[key] = plots
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= self._entry_size(evicted)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+chart_cache = ChartCache(getattr(settings, "CHART_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+
+def cached_comparation_plot(
+    portfolio_id: str,
+    fecha_inicio: str,
+    fecha_fin: str,
+    load_series: Callable[[], PortfolioSeries],
+    resolution: Resolution = "daily",
+) -> Plots:
+    """
+    comparation_plot of the range at the given resolution, rendered only when
+    the plots for the current version of the snapshots are not cached yet.
+    """
+    key = (
+        str(portfolio_id),
+        fecha_inicio,
+        fecha_fin,
+        resolution,
+        get_snapshot_version(),
+    )
+    plots = chart_cache.get(key)
+    if plots is None:
+        plots = comparation_plot(resample_series(load_series(), resolution))
+        chart_cache.set(key, plots)
+    return plots
@@ -0,0 +1,77 @@
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from portfolio.models import UploadDigest
+
+# (sheet, block, column), the whole workbook is ("", 0, "")
+DigestKey = Tuple[str, int, str]
+WORKBOOK_KEY: DigestKey = ("", 0, "")
+
+
+def file_digest(file_obj: Any) -> str:
+    """
+    sha256 of an uploaded file, read chunk by chunk.
+    """
+    digest = hashlib.sha256()
+    for chunk in file_obj.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def column_digests(
+    chunk: pd.DataFrame,
+    key_columns: List[str],
+    value_columns: Iterable[str],
+    context: str = "",
+) -> Dict[str, str]:
+    """
+    Digest of every value column of a block of rows. Each one also covers
+    the key columns of the rows and context, anything else the stored rows
+    depend on, so a change to either marks every column as changed.
+    """
+    keys = pd.util.hash_pandas_object(chunk[key_columns], index=False)
+    prefix = hashlib.sha256(context.encode())
+    prefix.update(keys.to_numpy().tobytes())
+
+    digests = {}
+    for column in value_columns:
+        digest = prefix.copy()
+        digest.update(column.encode())
+        values = pd.util.hash_pandas_object(chunk[column], index=False)
+        digest.update(values.to_numpy().tobytes())
+        digests[column] = digest.hexdigest()
+    return digests
+
+
+def load_digests() -> Dict[DigestKey, str]:
+    return {
+        (sheet, block, column): digest
+        for sheet, block, column, digest in UploadDigest.objects.values_list(
+            "sheet", "block", "column", "digest"
+        )
+    }
+
+
+def stored_file_digest() -> Optional[str]:
+    return (
+        UploadDigest.objects.filter(sheet="", block=0, column="")
+        .values_list("digest", flat=True)
+        .first()
+    )
+
+
+def save_digests(digests: Dict[DigestKey, str]) -> None:
+    """
+    Replace the stored digests, call it once the upload they describe is
+    stored.
+    """
+    UploadDigest.objects.all().delete()
+    UploadDigest.objects.bulk_create(
+        [
+            UploadDigest(sheet=sheet, block=block, column=column, digest=digest)
+            for (sheet, block, column), digest in digests.items()
+        ],
+        batch_size=2000,
+    )
@@ -0,0 +1,56 @@
+from typing import Any, Iterator, List, Tuple
+
+import openpyxl
+import pandas as pd
+
+EXCEL_CHUNK_ROWS = 500
+
+
+def open_workbook(source: Any) -> openpyxl.Workbook:
+    """
+    Open the workbook once in read-only mode, rows are parsed lazily when the
+    sheets are iterated.
+    """
+    return openpyxl.load_workbook(source, read_only=True, data_only=True)
+
+
+def read_sheet(
+    workbook: openpyxl.Workbook, sheet_name: str, chunk_rows: int = EXCEL_CHUNK_ROWS
+) -> Tuple[List[str], Iterator[pd.DataFrame]]:
+    """
+    inputs:
+    - workbook opened with open_workbook
+    - name of the sheet
+    - number of rows per chunk
+
+    output:
+    - header of the sheet
+    - generator of DataFrames with at most chunk_rows rows each
+    """
+    rows = workbook[sheet_name].iter_rows(values_only=True)
+    header = next(rows, ())
+    # Read-only sheets may report extra empty columns after the data
+    positions = [i for i, name in enumerate(header) if name is not None]
+    columns = [str(header[i]) for i in positions]
+
+    def chunks() -> Iterator[pd.DataFrame]:
+        chunk = []
+        for row in rows:
+            values = [row[i] if i < len(row) else None for i in positions]
+            if all(value is None for value in values):
+                continue
+            chunk.append(values)
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame.from_records(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame.from_records(chunk, columns=columns)
+
+    return columns, chunks()
+
+
+def concat_chunks(columns: List[str], chunks: Iterator[pd.DataFrame]) -> pd.DataFrame:
+    frames = list(chunks)
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
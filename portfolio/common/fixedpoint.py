@@ -0,0 +1,155 @@
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import Any, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+import numpy as np
+
+from portfolio.models import PortfolioSnapshot, Price, Tick
+
+VALUATION_MODES = ("float", "fixed")
+
+
+def valuation_mode() -> str:
+    """
+    PORTFOLIO_VALUATION_MODE, read on every call so a changed setting
+    applies: "float" values portfolios with float64, "fixed" with scaled
+    integers.
+    """
+    return getattr(settings, "PORTFOLIO_VALUATION_MODE", "float")
+
+
+def decimal_places(model: Any, field: str) -> int:
+    return model._meta.get_field(field).decimal_places
+
+
+# Scales of the stored fields: a price is kept as price * 10**PRICE_DECIMALS
+PRICE_DECIMALS = decimal_places(Price, "value")
+QUANTITY_DECIMALS = decimal_places(Tick, "quantity")
+VALUE_DECIMALS = decimal_places(PortfolioSnapshot, "value")
+
+INT64_MAX = np.iinfo(np.int64).max
+
+
+def to_fixed(values: Any, decimals: int) -> np.ndarray:
+    """
+    Array of values scaled by 10**decimals as int64, NaN as 0. Floats read
+    from the decimal fields are recovered exactly, Decimals are rounded half
+    to even like the database.
+    """
+    array = np.asarray(values)
+    if array.dtype == object:
+        step = Decimal(1).scaleb(-decimals)
+        return np.array(
+            [
+                int(Decimal(value).quantize(step, ROUND_HALF_EVEN).scaleb(decimals))
+                for value in array.ravel()
+            ],
+            dtype=np.int64,
+        ).reshape(array.shape)
+    scaled = np.rint(np.nan_to_num(array.astype(np.float64)) * 10**decimals)
+    return scaled.astype(np.int64)
+
+
+def from_fixed(values: Iterable[int], decimals: int) -> List[Decimal]:
+    """
+    Decimals of values scaled by 10**decimals, for the models.
+    """
+    return [Decimal(int(value)).scaleb(-decimals) for value in values]
+
+
+def round_scaled(values: np.ndarray, digits: int) -> np.ndarray:
+    """
+    values / 10**digits rounded half to even, in integer arithmetic.
+    """
+    if digits <= 0:
+        return values * 10**-digits
+    divisor = 10**digits
+    # Floor division, so the remainder is in [0, divisor) for negatives too.
+    # Not np.divmod, which has no loop for the Python integers
+    quotient = values // divisor
+    remainder = values - quotient * divisor
+    round_up = (2 * remainder > divisor) | (
+        (2 * remainder == divisor) & (quotient % 2 == 1)
+    )
+    return quotient + round_up
+
+
+def fixed_holdings(prices: np.ndarray, quantities: np.ndarray) -> np.ndarray:
+    """
+    Exact price * quantity of scaled prices and quantities, with scale
+    PRICE_DECIMALS + QUANTITY_DECIMALS. int64 when the row sums cannot
+    overflow, Python integers otherwise.
+    """
+    largest = int(np.abs(prices).max(initial=0)) * int(
+        np.abs(quantities).max(initial=0)
+    )
+    if largest * max(prices.shape[-1], 1) > INT64_MAX:
+        return prices.astype(object) * quantities.astype(object)
+    return prices * quantities
+
+
+def fixed_values(
+    prices: np.ndarray, quantities: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    inputs:
+    - prices: date x asset prices, NaN where the price is not known yet
+    - quantities: date x asset quantities held
+
+    output:
+    - values: portfolio value per date scaled by 10**VALUE_DECIMALS, the
+      exact sum rounded once like calculate_portfolio_value. from_fixed turns
+      it into Decimals
+    - holdings, totals: exact holdings and their sum per date, with the
+      scale of fixed_holdings
+    """
+    holdings = fixed_holdings(
+        to_fixed(prices, PRICE_DECIMALS), to_fixed(quantities, QUANTITY_DECIMALS)
+    )
+    totals = holdings.sum(axis=1)
+    scale = PRICE_DECIMALS + QUANTITY_DECIMALS
+    return round_scaled(totals, scale - VALUE_DECIMALS), holdings, totals
+
+
+def value_holdings(
+    prices: np.ndarray, quantities: np.ndarray, mode: Optional[str] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    inputs:
+    - prices: date x asset prices, NaN where the price is not known yet
+    - quantities: date x asset quantities held
+    - mode: "float" multiplies the float64 prices, "fixed" uses fixed_values,
+      valuation_mode() by default
+
+    output:
+    - values: portfolio value per date rounded to VALUE_DECIMALS, float64 in
+      both modes
+    - weights: date x asset weights
+    """
+    if mode is None:
+        mode = valuation_mode()
+    if mode not in VALUATION_MODES:
+        raise ValueError(f"Modo de valoración no válido: {mode}")
+
+    if mode == "fixed":
+        values, holdings, totals = fixed_values(prices, quantities)
+        # Floats from here on, like the rest of the series. Past 2**53 the
+        # integers themselves round, Python's int division rounds only once
+        if np.abs(values).max(initial=0) >= 2**53:
+            values = values.astype(object)
+        values = (values / 10**VALUE_DECIMALS).astype(np.float64)
+        holdings, totals = holdings.astype(np.float64), totals.astype(np.float64)
+    else:
+        # Assets without a known price yet do not contribute to the value
+        holdings = np.nan_to_num(prices * quantities)
+        totals = holdings.sum(axis=1)
+        values = totals.round(VALUE_DECIMALS)
+
+    weights = np.divide(
+        holdings,
+        totals[:, None],
+        out=np.zeros_like(holdings),
+        where=totals[:, None] != 0,
+    )
+    return values, weights
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+from django.core.cache import cache
+
+from portfolio.models import Asset, Portfolio
+
+from .prices import PRICE_VERSION_KEY, get_price_matrix
+from .snapshots import SNAPSHOT_VERSION_KEY
+from .versions import get_versions
+
+METADATA_KEY = "portfolio:metadata:{prices}:{snapshots}"
+
+# Metadata already unpickled by this process, tagged with its versions
+_loaded = {"versions": None, "metadata": None}
+
+
+@dataclass
+class PortfolioSummary:
+    id: int
+    name: str
+    value: Decimal
+
+    def __str__(self) -> str:
+        # Same as Portfolio.__str__, the templates render either
+        return f"Portafolio {self.id}"
+
+
+@dataclass
+class Metadata:
+    """
+    What the landing page and the transaction form need: the priced date
+    range, the trading days, the portfolios with their value and the
+    instances offered as choices.
+    """
+
+    min_date: Optional[str]
+    max_date: Optional[str]
+    trading_days: List[str]
+    portfolios: List[PortfolioSummary]
+    portfolio_choices: List[Portfolio]
+    asset_choices: List[Asset]
+
+    @classmethod
+    def load(cls) -> "Metadata":
+        matrix = get_price_matrix()
+        trading_days = [str(day) for day in matrix.dates]
+        portfolios = list(Portfolio.objects.order_by("id"))
+        return cls(
+            min_date=trading_days[0] if trading_days else None,
+            max_date=trading_days[-1] if trading_days else None,
+            trading_days=trading_days,
+            portfolios=[
+                PortfolioSummary(
+                    id=portfolio.id,
+                    name=portfolio.name,
+                    value=round(portfolio.value, 1),
+                )
+                for portfolio in portfolios
+            ],
+            portfolio_choices=portfolios,
+            asset_choices=list(Asset.objects.order_by("id")),
+        )
+
+
+def _versions() -> Tuple[str, str]:
+    return get_versions(PRICE_VERSION_KEY, SNAPSHOT_VERSION_KEY)
+
+
+def get_metadata() -> Metadata:
+    """
+    Metadata built once per version of the prices and of the snapshots.
+    Uploads bump both and transactions bump the snapshots, so it follows
+    every change of data while a page load costs one indexed query.
+    """
+    versions = _versions()
+    if _loaded["versions"] == versions:
+        return _loaded["metadata"]
+
+    key = METADATA_KEY.format(prices=versions[0], snapshots=versions[1])
+    metadata = cache.get(key)
+    if metadata is None:
+        metadata = Metadata.load()
+        cache.set(key, metadata, timeout=None)
+
+    _loaded["versions"] = versions
+    _loaded["metadata"] = metadata
+    return metadata
@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Same query run more times than this in one request is logged as N+1
+N_PLUS_ONE_THRESHOLD = getattr(settings, "N_PLUS_ONE_THRESHOLD", 10)
+
+
+class RequestMetrics:
+    """
+    SQL and timers of one request. Worker threads of the request add to it
+    too, run_in_worker copies the context.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.timers: Dict[str, float] = defaultdict(float)
+        self.statements: Counter = Counter()
+        self.lock = threading.Lock()
+
+    def add_query(self, sql: str, duration_ms: float) -> None:
+        with self.lock:
+            self.queries += 1
+            self.db_ms += duration_ms
+            self.statements[sql] += 1
+
+    def add_timer(self, name: str, duration_ms: float) -> None:
+        with self.lock:
+            self.timers[name] += duration_ms
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def repeated_statements(self, threshold: int = N_PLUS_ONE_THRESHOLD):
+        return [
+            (sql, count) for sql, count in self.statements.items() if count > threshold
+        ]
+
+
+# Totals that are counts rather than milliseconds
+COUNTERS = ("count", "queries", "bytes")
+
+
+class MetricsRegistry:
+    """
+    Totals since the process started, per view and per timer.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        self.views: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+        self.timers: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+
+    def _add(self, totals: Dict[str, float], duration_ms: float) -> None:
+        totals["count"] += 1
+        totals["total_ms"] += duration_ms
+        totals["max_ms"] = max(totals["max_ms"], duration_ms)
+
+    def record_request(
+        self, view: str, metrics: RequestMetrics, total_ms: float, size: Optional[int]
+    ) -> None:
+        with self.lock:
+            totals = self.views[view]
+            self._add(totals, total_ms)
+            totals["queries"] += metrics.queries
+            totals["db_ms"] += metrics.db_ms
+            totals["bytes"] += size or 0
+
+    def record_timer(self, name: str, duration_ms: float) -> None:
+        with self.lock:
+            self._add(self.timers[name], duration_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        def summary(totals):
+            count = totals["count"] or 1
+            return {
+                **{
+                    key: int(value) if key in COUNTERS else round(value, 3)
+                    for key, value in totals.items()
+                },
+                "mean_ms": round(totals["total_ms"] / count, 3),
+            }
+
+        with self.lock:
+            return {
+                "views": {name: summary(t) for name, t in self.views.items()},
+                "timers": {name: summary(t) for name, t in self.timers.items()},
+            }
+
+
+registry = MetricsRegistry()
+current_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar(
+    "current_metrics", default=None
+)
+
+
+def record_sql(execute: Callable, sql: str, params: Any, many: bool, context: Any):
+    """
+    Database execute wrapper, installed on every connection by the app config.
+    Only counts while a request is being measured.
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, (time.perf_counter() - start) * 1000)
+
+
+def install_sql_wrapper(sender: Any, connection: Any, **kwargs: Any) -> None:
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """
+    Time the block under name, in the current request and in the registry.
+    Can also decorate a function.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.add_timer(name, duration_ms)
+        registry.record_timer(name, duration_ms)
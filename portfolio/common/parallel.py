@@ -0,0 +1,239 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import django
+from django.conf import settings
+
+import numpy as np
+import pandas as pd
+
+from .fixedpoint import valuation_mode, value_holdings
+from .prices import PriceMatrix
+from .timeseries import compute_portfolio_series
+
+# Processes used to value portfolios, 1 keeps everything in this process
+PROCESS_WORKERS = getattr(settings, "PORTFOLIO_PROCESSES", 1)
+
+# Calendar days valued by each task
+SHARD_DAYS = getattr(settings, "PORTFOLIO_SHARD_DAYS", 366)
+
+# Below this many portfolio days the pool costs more than it saves
+PARALLEL_MIN_DAYS = getattr(settings, "PORTFOLIO_PARALLEL_MIN_DAYS", 20_000)
+
+Inputs = Tuple[pd.Series, pd.DataFrame]
+Result = Tuple[pd.Series, pd.DataFrame]
+
+
+class ShardTask(NamedTuple):
+    """
+    Everything a worker needs to value one portfolio over one date shard,
+    except the prices which are read from shared memory.
+    """
+
+    key: Any
+    shard: int
+    prices_name: str
+    prices_shape: Tuple[int, int]
+    day_rows: np.ndarray
+    asset_columns: np.ndarray
+    start_quantities: np.ndarray
+    delta_rows: np.ndarray
+    delta_values: np.ndarray
+    mode: str
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+# Price segment attached in a worker process, reused by the next tasks
+_attached: Dict[str, Any] = {}
+
+
+def get_process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Pool kept for the life of the process, rebuilt if the size changes.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown()
+            # Spawned, not forked: a fork copies the locks, connections and
+            # threads of a running server. The fresh interpreters need the
+            # apps loaded before they can import this module
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=django.setup,
+            )
+            _pool_workers = workers
+        return _pool
+
+
+@contextmanager
+def shared_prices(matrix: PriceMatrix) -> Iterator[Tuple[str, Tuple[int, int]]]:
+    """
+    Forward filled price matrix copied once into shared memory, the workers
+    attach to it by name instead of receiving a pickled copy per task.
+    """
+    filled = matrix.filled
+    segment = SharedMemory(create=True, size=max(filled.nbytes, 1))
+    try:
+        shared = np.ndarray(filled.shape, dtype=np.float64, buffer=segment.buf)
+        shared[:] = filled
+        del shared
+        yield segment.name, filled.shape
+    finally:
+        segment.close()
+        segment.unlink()
+
+
+def _attach_prices(name: str, shape: Tuple[int, int]) -> np.ndarray:
+    if _attached.get("name") != name:
+        if "segment" in _attached:
+            _attached.pop("prices")
+            _attached.pop("segment").close()
+        segment = SharedMemory(name=name)
+        _attached.update(
+            name=name,
+            segment=segment,
+            prices=np.ndarray(shape, dtype=np.float64, buffer=segment.buf),
+        )
+    return _attached["prices"]
+
+
+def value_shard(task: ShardTask) -> Tuple[Any, int, np.ndarray, np.ndarray]:
+    """
+    Worker side of compute_many: compute_portfolio_series over one shard,
+    starting from the quantities held the day before it.
+    """
+    prices = _attach_prices(task.prices_name, task.prices_shape)
+
+    days, assets = len(task.day_rows), len(task.asset_columns)
+    quantities = np.zeros((days, assets))
+    np.add.at(quantities, task.delta_rows, task.delta_values)
+    quantities = quantities.cumsum(axis=0) + task.start_quantities
+
+    # Days before the first price and assets without prices are NaN
+    price_rows = np.full((days, assets), np.nan)
+    known_days = task.day_rows >= 0
+    known_assets = task.asset_columns >= 0
+    price_rows[np.ix_(known_days, known_assets)] = prices[
+        np.ix_(task.day_rows[known_days], task.asset_columns[known_assets])
+    ]
+
+    values, weights = value_holdings(price_rows, quantities, task.mode)
+    return task.key, task.shard, values, weights
+
+
+def shard_tasks(
+    key: Any,
+    inputs: Inputs,
+    dates: pd.DatetimeIndex,
+    matrix: PriceMatrix,
+    prices_name: str,
+    prices_shape: Tuple[int, int],
+    shard_days: int,
+    mode: str,
+) -> Tuple[List[str], List[ShardTask]]:
+    """
+    Split the valuation of a portfolio in shards of shard_days calendar
+    days. Each shard carries the cumulative quantities of the days before it.
+    """
+    initial_quantities, deltas = inputs
+    assets = initial_quantities.index.union(deltas.columns)
+    initial = initial_quantities.reindex(assets).fillna(0).to_numpy()
+    deltas = deltas.reindex(columns=assets).fillna(0)
+    delta_days = deltas.index.to_numpy(dtype="datetime64[D]")
+    delta_values = deltas.to_numpy()
+    asset_columns = np.array([matrix.asset_index.get(asset, -1) for asset in assets])
+
+    calendar = dates.to_numpy(dtype="datetime64[D]")
+    day_rows = np.searchsorted(matrix.dates, calendar, side="right") - 1
+
+    tasks = []
+    for shard, first in enumerate(range(0, len(calendar), shard_days)):
+        shard_dates = calendar[first : first + shard_days]
+        before = delta_days < shard_dates[0]
+        inside = ~before & (delta_days <= shard_dates[-1])
+        tasks.append(
+            ShardTask(
+                key=key,
+                shard=shard,
+                prices_name=prices_name,
+                prices_shape=prices_shape,
+                day_rows=day_rows[first : first + shard_days],
+                asset_columns=asset_columns,
+                start_quantities=initial + delta_values[before].sum(axis=0),
+                delta_rows=(delta_days[inside] - shard_dates[0]).astype(int),
+                delta_values=delta_values[inside],
+                mode=mode,
+            )
+        )
+    return [str(asset) for asset in assets], tasks
+
+
+def compute_many(
+    matrix: PriceMatrix,
+    portfolios: Dict[Any, Inputs],
+    dates: pd.DatetimeIndex,
+    workers: Optional[int] = None,
+    shard_days: int = SHARD_DAYS,
+    min_days: int = PARALLEL_MIN_DAYS,
+) -> Dict[Any, Result]:
+    """
+    inputs:
+    - matrix: prices of every trading day
+    - portfolios: initial quantities and quantity deltas keyed by portfolio
+    - dates: dates of the output
+    - workers: processes to use, PORTFOLIO_PROCESSES by default
+    - min_days: portfolio days below which everything runs in this process
+
+    output:
+    - compute_portfolio_series of every portfolio. Small jobs run in this
+      process, the rest is sharded by portfolio and date over a process pool
+    """
+    if workers is None:
+        workers = PROCESS_WORKERS
+    if not portfolios or not len(dates):
+        return {}
+    # Read here, the workers do not see settings overridden in this process
+    mode = valuation_mode()
+
+    if workers <= 1 or len(portfolios) * len(dates) < min_days:
+        prices = matrix.frame(dates[0].date(), dates[-1].date())
+        return {
+            key: compute_portfolio_series(prices, initial, deltas, dates, mode)
+            for key, (initial, deltas) in portfolios.items()
+        }
+
+    with shared_prices(matrix) as (prices_name, prices_shape):
+        columns, tasks = {}, []
+        for key, inputs in portfolios.items():
+            columns[key], portfolio_tasks = shard_tasks(
+                key, inputs, dates, matrix, prices_name, prices_shape, shard_days, mode
+            )
+            tasks.extend(portfolio_tasks)
+
+        shards: Dict[Any, Dict[int, Tuple[np.ndarray, np.ndarray]]] = {}
+        pool = get_process_pool(workers)
+        for key, shard, values, weights in pool.map(value_shard, tasks):
+            shards.setdefault(key, {})[shard] = (values, weights)
+
+    results = {}
+    for key, parts in shards.items():
+        ordered = [parts[shard] for shard in sorted(parts)]
+        results[key] = (
+            pd.Series(np.concatenate([values for values, _ in ordered]), index=dates),
+            pd.DataFrame(
+                np.concatenate([weights for _, weights in ordered]),
+                index=dates,
+                columns=columns[key],
+            ),
+        )
+    return results
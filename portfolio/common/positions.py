@@ -0,0 +1,181 @@
+from bisect import bisect_left, bisect_right
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import F, Min
+
+from portfolio.models import Asset, Portfolio, Position, Tick, Transaction
+
+from .timeseries import load_initial_quantities_many, load_quantity_deltas_many
+
+# Decimal places of Position.quantity and Transaction.quantity
+QUANTITY_STEP = Decimal("0.0001")
+
+
+def rebuild_positions(portfolios: Optional[Iterable[Portfolio]] = None) -> int:
+    """
+    Replace the positions of the given portfolios (all by default) with the
+    ones given by their ticks and transactions. The ticks open every asset
+    on the first tick date, each transaction adds a position with the
+    running quantity. Returns the number of positions written.
+    """
+    if portfolios is None:
+        portfolios = Portfolio.objects.all()
+    portfolios = list(portfolios)
+    initial_quantities = load_initial_quantities_many(portfolios)
+    deltas = load_quantity_deltas_many(portfolios, date.max)
+    opened = dict(
+        Tick.objects.filter(portfolio__in=portfolios)
+        .values("portfolio")
+        .annotate(first_date=Min("date"))
+        .values_list("portfolio", "first_date")
+    )
+    asset_ids = dict(Asset.objects.values_list("name", "id"))
+
+    positions = {}
+    for portfolio in portfolios:
+        initial = initial_quantities.get(portfolio.pk)
+        if initial is not None and portfolio.pk in opened:
+            for asset, quantity in initial.items():
+                positions[portfolio.pk, asset, opened[portfolio.pk]] = quantity
+
+        portfolio_deltas = deltas.get(portfolio.pk)
+        if portfolio_deltas is None:
+            continue
+        running = portfolio_deltas.fillna(0).cumsum()
+        if initial is not None:
+            running = running.add(initial.reindex(running.columns).fillna(0), axis=1)
+        # Only the dates where the asset was traded get a position
+        traded = portfolio_deltas.notna().stack()
+        for (day, asset), quantity in running.stack()[traded].items():
+            positions[portfolio.pk, asset, day.date()] = quantity
+
+    with transaction.atomic():
+        Position.objects.filter(portfolio__in=portfolios).delete()
+        Position.objects.bulk_create(
+            [
+                Position(
+                    portfolio_id=portfolio_id,
+                    asset_id=asset_ids[asset],
+                    date=day,
+                    quantity=Decimal(str(quantity)).quantize(QUANTITY_STEP),
+                )
+                for (portfolio_id, asset, day), quantity in positions.items()
+            ],
+            batch_size=2000,
+        )
+    return len(positions)
+
+
+@transaction.atomic
+def record_transactions(transactions: Iterable[Transaction]) -> None:
+    """
+    Move the positions for newly created transactions: the position of the
+    transaction date and every later one of the same asset change by the
+    traded quantity.
+    """
+    for record in transactions:
+        # Rounded like the stored quantity
+        delta = Decimal(record.quantity).quantize(QUANTITY_STEP)
+        if record.transaction_type == "sell":
+            delta = -delta
+
+        positions = Position.objects.filter(
+            portfolio_id=record.portfolio_id, asset_id=record.asset_id
+        )
+        if not positions.filter(date=record.date).exists():
+            held = held_quantity(record.portfolio_id, record.asset_id, record.date)
+            positions.create(
+                portfolio_id=record.portfolio_id,
+                asset_id=record.asset_id,
+                date=record.date,
+                quantity=held or 0,
+            )
+        positions.filter(date__gte=record.date).update(quantity=F("quantity") + delta)
+
+
+def held_quantity(
+    portfolio: int, asset: int, day: Optional[date] = None
+) -> Optional[Decimal]:
+    """
+    Quantity held at the end of day (today by default), None when the asset
+    was never in the portfolio up to then. One indexed lookup.
+    """
+    return (
+        Position.objects.filter(
+            portfolio=portfolio, asset=asset, date__lte=day or date.max
+        )
+        .order_by("-date")
+        .values_list("quantity", flat=True)
+        .first()
+    )
+
+
+class PositionLedger:
+    """
+    Positions of some portfolios loaded in memory with one query, to
+    validate many trades in a row without a query each. apply keeps it in
+    sync with the trades already accepted.
+    """
+
+    def __init__(self) -> None:
+        self.dates: Dict[Tuple[int, int], List[date]] = {}
+        self.quantities: Dict[Tuple[int, int], List[Decimal]] = {}
+
+    @classmethod
+    def load(
+        cls, portfolios: Iterable[int], assets: Optional[Iterable[int]] = None
+    ) -> "PositionLedger":
+        """
+        Positions of the portfolios, only of the given assets if any.
+        """
+        ledger = cls()
+        positions = Position.objects.filter(portfolio__in=portfolios)
+        if assets is not None:
+            positions = positions.filter(asset__in=assets)
+        rows = positions.order_by("portfolio", "asset", "date").values_list(
+            "portfolio", "asset", "date", "quantity"
+        )
+        for portfolio, asset, day, quantity in rows:
+            ledger.dates.setdefault((portfolio, asset), []).append(day)
+            ledger.quantities.setdefault((portfolio, asset), []).append(quantity)
+        return ledger
+
+    def held(self, portfolio: int, asset: int, day: date) -> Optional[Decimal]:
+        """
+        Same as held_quantity.
+        """
+        dates = self.dates.get((portfolio, asset), [])
+        position = bisect_right(dates, day)
+        if position == 0:
+            return None
+        return self.quantities[portfolio, asset][position - 1]
+
+    def available(self, portfolio: int, asset: int, day: date) -> Optional[Decimal]:
+        """
+        Quantity that can be sold on day without leaving any later position
+        negative, None when the asset is not held on that day.
+        """
+        held = self.held(portfolio, asset, day)
+        if held is None:
+            return None
+        later = self.quantities[portfolio, asset][
+            bisect_right(self.dates[portfolio, asset], day) :
+        ]
+        return min([held, *later])
+
+    def apply(self, portfolio: int, asset: int, day: date, delta: Decimal) -> None:
+        """
+        Same as record_transactions for one trade of delta units.
+        """
+        dates = self.dates.setdefault((portfolio, asset), [])
+        quantities = self.quantities.setdefault((portfolio, asset), [])
+        position = bisect_left(dates, day)
+        if position == len(dates) or dates[position] != day:
+            held = quantities[position - 1] if position > 0 else Decimal(0)
+            dates.insert(position, day)
+            quantities.insert(position, held)
+        for later in range(position, len(quantities)):
+            quantities[later] += delta
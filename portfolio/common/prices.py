@@ -0,0 +1,194 @@
+import logging
+from datetime import date
+from decimal import Decimal
+from functools import cached_property
+from typing import List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db.models import Max, Min
+
+import numpy as np
+import pandas as pd
+
+from portfolio.models import Price
+
+from .versions import bump_version, get_version
+
+logger = logging.getLogger(__name__)
+
+# DataVersion of the prices, bumped once new prices are committed
+PRICE_VERSION_KEY = "prices"
+PRICE_MATRIX_KEY = "portfolio:prices:matrix:{version}"
+
+# Matrix already unpickled by this process, tagged with its version
+_loaded = {"version": None, "matrix": None}
+
+
+class PriceMatrix:
+    """
+    Every price as a trading day x asset float matrix, NaN where an asset has
+    no price for a day. Row i holds the prices with Price.date_id == i.
+    """
+
+    def __init__(self, dates: np.ndarray, assets: List[str], values: np.ndarray):
+        self.dates = dates
+        self.assets = assets
+        self.values = values
+        self.asset_index = {name: i for i, name in enumerate(assets)}
+        self.date_index = {day: i for i, day in enumerate(dates.tolist())}
+
+    def __getstate__(self) -> dict:
+        # The filled copy is rebuilt by each process instead of doubling the
+        # cached pickle
+        state = self.__dict__.copy()
+        state.pop("filled", None)
+        return state
+
+    @cached_property
+    def filled(self) -> np.ndarray:
+        """
+        values with every price carried forward over the later days where an
+        asset has none, the same whatever range is asked for.
+        """
+        return pd.DataFrame(self.values).ffill().to_numpy(dtype=np.float64)
+
+    @classmethod
+    def load(cls) -> "PriceMatrix":
+        rows = Price.objects.values_list("date_id", "date", "asset__name", "value")
+        df = pd.DataFrame.from_records(
+            rows, columns=["date_id", "date", "asset", "value"]
+        )
+        if df.empty:
+            return cls(np.array([], dtype="datetime64[D]"), [], np.empty((0, 0)))
+
+        date_ids = df["date"].rank(method="dense").astype(int).to_numpy() - 1
+        if not np.array_equal(date_ids, df["date_id"].to_numpy()):
+            logger.warning("Price.date_id is not dense, run renumber_trading_days")
+        else:
+            date_ids = df["date_id"].to_numpy()
+
+        asset_codes, assets = pd.factorize(df["asset"], sort=True)
+        values = np.full((date_ids.max() + 1, len(assets)), np.nan)
+        values[date_ids, asset_codes] = df["value"].to_numpy(dtype=float)
+        dates = np.empty(len(values), dtype="datetime64[D]")
+        dates[date_ids] = df["date"].to_numpy(dtype="datetime64[D]")
+        return cls(dates, list(assets), values)
+
+    def reload_since(self, since: date) -> "PriceMatrix":
+        """
+        Copy with the prices from since on read again from the database and
+        the earlier rows kept, for when only the last days changed.
+        """
+        keep = int(np.searchsorted(self.dates, np.datetime64(since, "D")))
+        rows = Price.objects.filter(date__gte=since).values_list(
+            "date", "asset__name", "value"
+        )
+        df = pd.DataFrame.from_records(rows, columns=["date", "asset", "value"])
+
+        assets = sorted(set(self.assets).union(df["asset"]))
+        asset_index = {name: i for i, name in enumerate(assets)}
+        new_dates = np.unique(df["date"].to_numpy(dtype="datetime64[D]"))
+        dates = np.concatenate([self.dates[:keep], new_dates])
+
+        values = np.full((len(dates), len(assets)), np.nan)
+        values[:keep, [asset_index[name] for name in self.assets]] = self.values[:keep]
+        date_rows = keep + np.searchsorted(
+            new_dates, df["date"].to_numpy(dtype="datetime64[D]")
+        )
+        asset_columns = df["asset"].map(asset_index).to_numpy(dtype=int)
+        values[date_rows, asset_columns] = df["value"].to_numpy(dtype=float)
+        return PriceMatrix(dates, assets, values)
+
+    @property
+    def min_date(self) -> Optional[date]:
+        return self.dates[0].item() if len(self.dates) else None
+
+    @property
+    def max_date(self) -> Optional[date]:
+        return self.dates[-1].item() if len(self.dates) else None
+
+    def row(self, day: date) -> Optional[int]:
+        """
+        date_id of the day, None if it is not a trading day.
+        """
+        return self.date_index.get(day)
+
+    def get(self, asset_name: str, day: date) -> Optional[Decimal]:
+        """
+        Price of the asset on the date, None if there is none.
+        """
+        row = self.row(day)
+        column = self.asset_index.get(asset_name)
+        if row is None or column is None or np.isnan(self.values[row, column]):
+            return None
+        value = float(self.values[row, column])
+        return Decimal(repr(value)).quantize(Decimal("0.00001"))
+
+    def offsets(self, start: date, end: date) -> Tuple[int, int]:
+        """
+        Row slice covering the two dates, starting at the last trading day on
+        or before start.
+        """
+        first = np.searchsorted(self.dates, np.datetime64(start, "D"), side="right")
+        last = np.searchsorted(self.dates, np.datetime64(end, "D"), side="right")
+        return max(int(first) - 1, 0), int(last)
+
+    def frame(self, start: date, end: date) -> pd.DataFrame:
+        """
+        Forward filled prices between the two dates as a DataFrame, starting
+        at the last trading day on or before start so calendar days without
+        prices can be filled too.
+        """
+        first, last = self.offsets(start, end)
+        return pd.DataFrame(
+            self.filled[first:last],
+            index=pd.DatetimeIndex(self.dates[first:last].astype("datetime64[ns]")),
+            columns=self.assets,
+        )
+
+
+def get_price_matrix() -> PriceMatrix:
+    """
+    The price matrix is built once from the database and shared through the
+    cache; each process keeps its copy until the version changes.
+    """
+    version = get_version(PRICE_VERSION_KEY)
+    if _loaded["version"] == version:
+        return _loaded["matrix"]
+
+    key = PRICE_MATRIX_KEY.format(version=version)
+    matrix = cache.get(key)
+    if matrix is None:
+        matrix = PriceMatrix.load()
+        cache.set(key, matrix, timeout=None)
+
+    _loaded["version"] = version
+    _loaded["matrix"] = matrix
+    return matrix
+
+
+def renumber_trading_days() -> int:
+    """
+    Keep Price.date_id as the position of its date among all trading days,
+    only the days whose position changed are rewritten. Returns the number of
+    days renumbered.
+    """
+    days = (
+        Price.objects.values("date")
+        .annotate(first_id=Min("date_id"), last_id=Max("date_id"))
+        .order_by("date")
+    )
+    renumbered = 0
+    for date_id, day in enumerate(days):
+        if day["first_id"] != date_id or day["last_id"] != date_id:
+            Price.objects.filter(date=day["date"]).update(date_id=date_id)
+            renumbered += 1
+    return renumbered
+
+
+def invalidate_price_matrix() -> None:
+    """
+    Bump the version so every process reloads the prices on next access.
+    """
+    cache.delete(PRICE_MATRIX_KEY.format(version=get_version(PRICE_VERSION_KEY)))
+    bump_version(PRICE_VERSION_KEY)
@@ -0,0 +1,119 @@
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from .metrics import timed
+from .prices import PriceMatrix, get_price_matrix
+from .timeseries import PortfolioSeries
+
+Resolution = Union[str, int]
+
+RESOLUTIONS = ("daily", "trading", "weekly", "monthly")
+
+# Points drawn by compare_data when no resolution is given, about the width
+# of the chart in pixels
+CHART_POINTS = 1000
+
+_PERIODS = {"weekly": "W", "monthly": "M"}
+
+
+def parse_resolution(raw: Optional[str], default: Resolution = "daily") -> Resolution:
+    """
+    daily, trading, weekly, monthly or the number of points to keep.
+    Raises ValueError for anything else.
+    """
+    if raw is None or raw == "":
+        return default
+    if raw in RESOLUTIONS:
+        return raw
+    if raw.isdigit() and int(raw) >= 3:
+        return int(raw)
+    raise ValueError(
+        "Invalid resolution. Use daily, trading, weekly, monthly or a number "
+        "of points greater than 2."
+    )
+
+
+def trading_day_indices(
+    series: PortfolioSeries, matrix: Optional[PriceMatrix] = None
+) -> np.ndarray:
+    """
+    Positions of the dates of the series that have prices.
+    """
+    if matrix is None:
+        matrix = get_price_matrix()
+    dates = np.array(series.dates, dtype="datetime64[D]")
+    return np.flatnonzero(np.isin(dates, matrix.dates))
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: keeps the first and last points and, for
+    each of the threshold - 2 buckets in between, the point forming the
+    largest triangle with the previously kept point and the mean of the
+    next bucket.
+    """
+    size = len(y)
+    if threshold >= size:
+        return np.arange(size)
+
+    edges = np.linspace(1, size - 1, threshold - 1).astype(int)
+    kept = np.empty(threshold, dtype=int)
+    kept[0] = 0
+    kept[-1] = size - 1
+
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # The bucket after the last one is the last point alone
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else size
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+
+        previous = kept[bucket]
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        kept[bucket + 1] = start + int(np.argmax(areas))
+
+    return kept
+
+
+@timed("resample")
+def resample_series(
+    series: PortfolioSeries,
+    resolution: Resolution,
+    matrix: Optional[PriceMatrix] = None,
+) -> PortfolioSeries:
+    """
+    inputs:
+    - series: one entry per calendar day
+    - resolution:
+        daily: unchanged
+        trading: only the days with prices
+        weekly / monthly: the last trading day of each period
+        number: at most that many trading days picked with LTTB on the value
+
+    output:
+    - series with the selected dates, values and weights are not averaged
+      so every point is a real close of the portfolio
+    """
+    if resolution == "daily" or not series.dates:
+        return series
+
+    indices = trading_day_indices(series, matrix)
+    if resolution == "trading" or len(indices) == 0:
+        return series.take(indices)
+
+    if resolution in _PERIODS:
+        periods = pd.DatetimeIndex([series.dates[i] for i in indices]).to_period(
+            _PERIODS[resolution]
+        )
+        # Last position of each period, the periods are already sorted
+        last = np.append(periods[1:] != periods[:-1], True)
+        return series.take(indices[last])
+
+    x = np.array(series.dates, dtype="datetime64[D]")[indices].astype(float)
+    y = series.values[indices].astype(float)
+    return series.take(indices[lttb_indices(x, y, resolution)])
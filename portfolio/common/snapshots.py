@@ -0,0 +1,149 @@
+from datetime import date
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, Dict, Iterable, Optional
+
+from django.db import transaction
+
+import numpy as np
+import pandas as pd
+
+from portfolio.models import Portfolio, PortfolioSnapshot
+
+from .parallel import compute_many
+from .prices import PriceMatrix, get_price_matrix
+from .timeseries import (
+    PortfolioSeries,
+    empty_quantity_deltas,
+    load_initial_quantities_many,
+    load_quantity_deltas_many,
+)
+from .versions import bump_version, get_version
+
+# DataVersion of the snapshots, bumped when a refresh is committed
+SNAPSHOT_VERSION_KEY = "snapshots"
+
+
+def refresh_snapshots(
+    portfolios: Optional[Iterable[Portfolio]] = None,
+    from_date: Optional[date] = None,
+    matrix: Optional[PriceMatrix] = None,
+    workers: Optional[int] = None,
+) -> int:
+    """
+    Recompute the daily snapshots of the given portfolios (all by default)
+    from from_date up to the last price, older snapshots are kept as is.
+    The valuation runs on workers processes, see compute_many.
+    Returns the number of snapshots written.
+    """
+    if matrix is None:
+        matrix = get_price_matrix()
+    if matrix.max_date is None:
+        return 0
+
+    # Whatever was derived from the old snapshots is stale once this commits
+    transaction.on_commit(bump_snapshot_version)
+
+    start = max(from_date, matrix.min_date) if from_date else matrix.min_date
+    end = matrix.max_date
+    if start > end:
+        return 0
+
+    dates = pd.date_range(start, end)
+    if portfolios is None:
+        portfolios = Portfolio.objects.all()
+    portfolios = list(portfolios)
+    initial_quantities = load_initial_quantities_many(portfolios)
+    deltas = load_quantity_deltas_many(portfolios, end)
+    series = compute_many(
+        matrix,
+        {
+            portfolio.pk: (
+                initial_quantities.get(portfolio.pk, pd.Series(dtype=float)),
+                deltas.get(portfolio.pk, empty_quantity_deltas()),
+            )
+            for portfolio in portfolios
+        },
+        dates,
+        workers,
+    )
+
+    written = 0
+    for portfolio in portfolios:
+        values, weights = series[portfolio.pk]
+        assets = list(weights.columns)
+        snapshots = [
+            PortfolioSnapshot(
+                portfolio=portfolio,
+                date=day.date(),
+                value=Decimal(str(value)),
+                weights=dict(zip(assets, row)),
+            )
+            for day, value, row in zip(
+                dates, values.tolist(), weights.to_numpy().tolist()
+            )
+        ]
+        PortfolioSnapshot.objects.filter(portfolio=portfolio, date__gte=start).delete()
+        PortfolioSnapshot.objects.bulk_create(snapshots, batch_size=500)
+        written += len(snapshots)
+
+    return written
+
+
+def get_snapshot_version() -> str:
+    return get_version(SNAPSHOT_VERSION_KEY)
+
+
+def bump_snapshot_version() -> None:
+    bump_version(SNAPSHOT_VERSION_KEY)
+
+
+def load_snapshot_series(
+    portfolio: Any, fecha_inicio: date, fecha_fin: date, portfolio_id: Any
+) -> Optional[PortfolioSeries]:
+    """
+    Series of the range read from the snapshot table, or None when any day
+    of the range has not been snapshotted yet.
+    """
+    return load_snapshot_series_many(
+        {portfolio_id: portfolio}, fecha_inicio, fecha_fin
+    ).get(portfolio_id)
+
+
+def load_snapshot_series_many(
+    portfolios: Dict[Any, Portfolio], fecha_inicio: date, fecha_fin: date
+) -> Dict[Any, PortfolioSeries]:
+    """
+    load_snapshot_series of several portfolios, given and returned keyed by
+    the id used in the API, one query. Portfolios with days missing in the
+    range are left out.
+    """
+    keys = {portfolio.pk: key for key, portfolio in portfolios.items()}
+    rows = (
+        PortfolioSnapshot.objects.filter(
+            portfolio__in=portfolios.values(), date__range=[fecha_inicio, fecha_fin]
+        )
+        .order_by("portfolio", "date")
+        .values_list("portfolio_id", "date", "value", "weights")
+    )
+    days = (fecha_fin - fecha_inicio).days + 1
+
+    series = {}
+    for portfolio_pk, group in groupby(rows, key=itemgetter(0)):
+        group = list(group)
+        if len(group) != days:
+            continue
+
+        _, dates, values, weights = zip(*group)
+        # Assets bought after the first day only appear in later snapshots
+        weights = pd.DataFrame.from_records(weights).fillna(0)
+        key = keys[portfolio_pk]
+        series[key] = PortfolioSeries(
+            portfolio=key,
+            dates=[day.strftime("%Y-%m-%d") for day in dates],
+            values=np.array(values, dtype=float),
+            assets=list(weights.columns),
+            weights=weights.to_numpy(dtype=float),
+        )
+    return series
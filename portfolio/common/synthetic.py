@@ -0,0 +1,105 @@
+from datetime import date
+from io import BytesIO
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from portfolio.models import Asset, Portfolio, Transaction
+
+from .prices import get_price_matrix
+
+
+def build_workbook(
+    assets: int, days: int, portfolios: int, start: date, seed: int = 0
+) -> BytesIO:
+    """
+    Workbook with the same layout as the uploaded ones: a "weights" sheet
+    with the initial weight of every asset per portfolio and a "Precios"
+    sheet with one random walk per asset over the trading days.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, periods=days)
+    asset_names = [f"Activo {i + 1}" for i in range(assets)]
+
+    returns = rng.normal(0.0003, 0.015, size=(days, assets))
+    prices = pd.DataFrame(
+        (100 * np.cumprod(1 + returns, axis=0)).round(4), columns=asset_names
+    )
+    prices.insert(0, "Dates", dates)
+
+    weights = pd.DataFrame({"Fecha": dates[0], "activos": asset_names})
+    for portfolio in range(portfolios):
+        raw = rng.random(assets)
+        weights[f"portafolio {portfolio + 1}"] = raw / raw.sum()
+
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        weights.to_excel(writer, sheet_name="weights", index=False)
+        prices.to_excel(writer, sheet_name="Precios", index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def append_price_days(source: bytes, days: int, seed: int = 0) -> BytesIO:
+    """
+    Copy of a build_workbook workbook with the random walks of the "Precios"
+    sheet continued for days more trading days, like a daily price update.
+    """
+    rng = np.random.default_rng(seed)
+    sheets = pd.read_excel(BytesIO(source), sheet_name=None)
+    prices = sheets["Precios"]
+    assets = prices.columns[1:]
+
+    dates = pd.bdate_range(prices["Dates"].iloc[-1], periods=days + 1)[1:]
+    returns = rng.normal(0.0003, 0.015, size=(days, len(assets)))
+    walks = prices[assets].iloc[-1].to_numpy() * np.cumprod(1 + returns, axis=0)
+    extra = pd.DataFrame(walks.round(4), columns=assets)
+    extra.insert(0, "Dates", dates)
+    sheets["Precios"] = pd.concat([prices, extra], ignore_index=True)
+
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        for name, sheet in sheets.items():
+            sheet.to_excel(writer, sheet_name=name, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def create_transactions(count: int, seed: int = 0) -> List[Transaction]:
+    """
+    Random buy/sell pairs between the assets of the loaded portfolios, each
+    moving a small amount of value on a random trading day.
+    """
+    rng = np.random.default_rng(seed)
+    matrix = get_price_matrix()
+    portfolios = list(Portfolio.objects.all())
+    assets = {asset.name: asset for asset in Asset.objects.all()}
+    names = [name for name in matrix.assets if name in assets]
+    if not portfolios or len(names) < 2 or not len(matrix.dates):
+        return []
+
+    transactions = []
+    for _ in range(count):
+        portfolio = portfolios[rng.integers(len(portfolios))]
+        row = int(rng.integers(len(matrix.dates)))
+        sell, buy = rng.choice(len(names), size=2, replace=False)
+        value = float(rng.uniform(1_000, 100_000))
+        day = matrix.dates[row].item()
+        for column, transaction_type in ((sell, "sell"), (buy, "buy")):
+            price = matrix.values[row, matrix.asset_index[names[column]]]
+            if np.isnan(price):
+                continue
+            transactions.append(
+                Transaction(
+                    portfolio=portfolio,
+                    asset=assets[names[column]],
+                    date=day,
+                    price=round(price, 2),
+                    quantity=round(value / price, 4),
+                    value=round(value, 2),
+                    transaction_type=transaction_type,
+                )
+            )
+
+    return Transaction.objects.bulk_create(transactions, batch_size=2000)
@@ -0,0 +1,193 @@
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from portfolio.models import Tick, Transaction
+
+from .fixedpoint import value_holdings
+from .prices import get_price_matrix
+
+
+def load_price_frame(fecha_inicio: date, fecha_fin: date) -> pd.DataFrame:
+    """
+    Date x asset forward filled prices between the two dates, taken from the
+    cached price matrix. The last trading day on or before the start date is
+    included so calendar days without prices can be forward filled.
+    """
+    return get_price_matrix().frame(fecha_inicio, fecha_fin)
+
+
+def load_initial_quantities(portfolio: Any) -> pd.Series:
+    """
+    Quantities of each asset given by the uploaded weights, one query.
+    """
+    return load_initial_quantities_many([portfolio]).get(
+        portfolio.pk, pd.Series(dtype=float)
+    )
+
+
+def load_initial_quantities_many(portfolios: Iterable[Any]) -> Dict[int, pd.Series]:
+    """
+    load_initial_quantities of several portfolios keyed by their pk, one query.
+    """
+    rows = (
+        Tick.objects.filter(portfolio__in=portfolios)
+        .order_by("date")
+        .values_list("portfolio_id", "asset__name", "quantity")
+    )
+    # Later ticks of the same asset overwrite earlier ones
+    quantities: Dict[int, Dict[str, float]] = {}
+    for portfolio_id, asset, quantity in rows:
+        quantities.setdefault(portfolio_id, {})[asset] = float(quantity)
+    return {
+        portfolio_id: pd.Series(assets, dtype=float)
+        for portfolio_id, assets in quantities.items()
+    }
+
+
+def load_quantity_deltas(portfolio: Any, fecha_fin: date) -> pd.DataFrame:
+    """
+    Signed quantity change per date and asset for every transaction up to the
+    end date, one query.
+    """
+    return load_quantity_deltas_many([portfolio], fecha_fin).get(
+        portfolio.pk, empty_quantity_deltas()
+    )
+
+
+def load_quantity_deltas_many(
+    portfolios: Iterable[Any], fecha_fin: date
+) -> Dict[int, pd.DataFrame]:
+    """
+    load_quantity_deltas of several portfolios keyed by their pk, one query.
+    Portfolios without transactions are left out.
+    """
+    rows = Transaction.objects.filter(
+        portfolio__in=portfolios, date__lte=fecha_fin
+    ).values_list("portfolio_id", "date", "asset__name", "quantity", "transaction_type")
+    df = pd.DataFrame.from_records(
+        rows, columns=["portfolio", "date", "asset", "quantity", "transaction_type"]
+    )
+    if df.empty:
+        return {}
+
+    df["date"] = pd.to_datetime(df["date"])
+    df["quantity"] = df["quantity"].astype(float)
+    df.loc[df["transaction_type"] == "sell", "quantity"] *= -1
+    return {
+        portfolio_id: group.pivot_table(
+            index="date", columns="asset", values="quantity", aggfunc="sum"
+        )
+        for portfolio_id, group in df.groupby("portfolio")
+    }
+
+
+def empty_quantity_deltas() -> pd.DataFrame:
+    return pd.DataFrame(index=pd.DatetimeIndex([]), dtype=float)
+
+
+def compute_portfolio_series(
+    prices: pd.DataFrame,
+    initial_quantities: pd.Series,
+    deltas: pd.DataFrame,
+    dates: pd.DatetimeIndex,
+    mode: Optional[str] = None,
+) -> Tuple[pd.Series, pd.DataFrame]:
+    """
+    inputs:
+    - prices: date x asset price matrix
+    - initial_quantities: quantity per asset before any transaction
+    - deltas: date x asset signed transaction quantities
+    - dates: dates of the output
+    - mode: valuation mode, see value_holdings
+
+    output:
+    - values: portfolio value per date
+    - weights: date x asset weights
+    """
+    assets = initial_quantities.index.union(deltas.columns)
+
+    # Transactions before the first requested date fold into the start position
+    full_index = dates.union(deltas.index)
+    quantities = (
+        deltas.reindex(index=full_index, columns=assets)
+        .fillna(0)
+        .cumsum()
+        .add(initial_quantities.reindex(assets).fillna(0), axis=1)
+        .reindex(dates)
+    )
+
+    price_matrix = (
+        prices.reindex(index=prices.index.union(dates), columns=assets)
+        .ffill()
+        .reindex(dates)
+    )
+
+    values, weights = value_holdings(
+        price_matrix.to_numpy(), quantities.to_numpy(), mode
+    )
+
+    return (
+        pd.Series(values, index=dates),
+        pd.DataFrame(weights, index=dates, columns=assets),
+    )
+
+
+@dataclass
+class PortfolioSeries:
+    """
+    Value and weights of a portfolio over a range, stored by column.
+    weights has one row per date and one column per asset.
+    """
+
+    portfolio: Any
+    dates: List[str]
+    values: np.ndarray
+    assets: List[str]
+    weights: np.ndarray
+
+    @classmethod
+    def from_frames(
+        cls, portfolio: Any, values: pd.Series, weights: pd.DataFrame
+    ) -> "PortfolioSeries":
+        return cls(
+            portfolio=portfolio,
+            dates=list(values.index.strftime("%Y-%m-%d")),
+            values=values.to_numpy(),
+            assets=[str(asset) for asset in weights.columns],
+            weights=weights.to_numpy(),
+        )
+
+    def take(self, indices: np.ndarray) -> "PortfolioSeries":
+        """
+        Series with only the dates at the given positions.
+        """
+        return PortfolioSeries(
+            portfolio=self.portfolio,
+            dates=[self.dates[i] for i in indices],
+            values=self.values[indices],
+            assets=self.assets,
+            weights=self.weights[indices],
+        )
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """
+        One dict per date, the shape returned by /api/portfolio-data/, built
+        as they are consumed.
+        """
+        for position, day in enumerate(self.dates):
+            yield {
+                "date": day,
+                "portfolio": self.portfolio,
+                "value": self.values[position].item(),
+                "weights": dict(zip(self.assets, self.weights[position].tolist())),
+            }
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """
+        Same as iter_records as a list.
+        """
+        return list(self.iter_records())
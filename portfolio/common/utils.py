@@ -3,7 +3,8 @@ from decimal import Decimal
 import pandas as pd
 import plotly.express as px
 
-from portfolio.models import Price
+from .metrics import timed
+from .prices import get_price_matrix
 
 
 def calculate_actives_cuantity(weight, price, portafolio):
@@ -31,14 +32,13 @@ def calculate_portfolio_value(quantities, prices):
     return value
 
 
-def comparation_plot(data):
-    dates = [entry["date"] for entry in data]
-    values = [entry["value"] for entry in data]
-    weights = [entry["weights"] for entry in data]
+@timed("plot")
+def comparation_plot(series):
+    dates = series.dates
+    values = series.values
 
     # Data preparation for weights plot
-    weights_df = pd.DataFrame(weights, index=dates)
-    weights_df = weights_df.apply(pd.to_numeric, errors="coerce").fillna(0)
+    weights_df = pd.DataFrame(series.weights, index=dates, columns=series.assets)
 
     # Plot portfolio values using Plotly
     value_fig = px.line(x=dates, y=values, labels={"x": "Date", "y": "Value"})
@@ -46,7 +46,8 @@ def comparation_plot(data):
         yaxis=dict(autorange=True, title="Valor", type="linear"),
         xaxis=dict(title="Fecha"),
     )
-    value_plot = value_fig.to_html(full_html=False)
+    # plotly.js is loaded once from the CDN instead of inlined in each plot
+    value_plot = value_fig.to_html(full_html=False, include_plotlyjs="cdn")
 
     # Plot weights as stacked area chart using Plotly
     weights_df = weights_df.reset_index().melt(
@@ -60,16 +61,15 @@ def comparation_plot(data):
         yaxis=dict(autorange=True, title="Weight", type="linear"),
         xaxis=dict(title="Fecha"),
     )
-    weights_plot = weights_fig.to_html(full_html=False)
+    weights_plot = weights_fig.to_html(full_html=False, include_plotlyjs=False)
 
     return value_plot, weights_plot
 
 
 def get_minmax_range():
-    min_date_obj = Price.objects.values_list("date", flat=True).order_by("date").first()
-    max_date_obj = (
-        Price.objects.values_list("date", flat=True).order_by("-date").first()
-    )
+    matrix = get_price_matrix()
+    min_date_obj = matrix.min_date
+    max_date_obj = matrix.max_date
 
     if not min_date_obj or not max_date_obj:
         return None, None
@@ -0,0 +1,39 @@
+import uuid
+from typing import Tuple
+
+from portfolio.models import DataVersion
+
+
+def new_token() -> str:
+    return uuid.uuid4().hex
+
+
+def get_versions(*names: str) -> Tuple[str, ...]:
+    """
+    Current token of each named set of data, one query. Sets never bumped
+    get a token on first use.
+    """
+    tokens = dict(
+        DataVersion.objects.filter(name__in=names).values_list("name", "token")
+    )
+    for name in names:
+        if name not in tokens:
+            version, _ = DataVersion.objects.get_or_create(
+                name=name, defaults={"token": new_token()}
+            )
+            tokens[name] = version.token
+    return tuple(tokens[name] for name in names)
+
+
+def get_version(name: str) -> str:
+    return get_versions(name)[0]
+
+
+def bump_version(name: str) -> str:
+    """
+    Replace the token of the named data, every entry cached with the old
+    one is stale from then on.
+    """
+    token = new_token()
+    DataVersion.objects.update_or_create(name=name, defaults={"token": token})
+    return token
@@ -0,0 +1,38 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, TypeVar
+
+from django.conf import settings
+from django.db import close_old_connections
+
+T = TypeVar("T")
+
+# Shared by the async views for the range queries and the plots, so a heavy
+# request takes one worker instead of the event loop or the single thread
+# Django runs every sync view on under ASGI
+executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "PORTFOLIO_WORKERS", None),
+    thread_name_prefix="portfolio",
+)
+
+
+def _call_and_close(function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    try:
+        return function(*args, **kwargs)
+    finally:
+        # Each worker thread has its own database connection
+        close_old_connections()
+
+
+async def run_in_worker(function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Await function(*args, **kwargs) run on the worker pool, with the context
+    variables of the caller such as the metrics of the request.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        executor, partial(context.run, _call_and_close, function, *args, **kwargs)
+    )
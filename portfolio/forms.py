@@ -1,6 +1,8 @@
 from django import forms
+from django.forms.models import ModelChoiceIterator
 
-from .models import Asset, Portfolio, Price, Tick, Transaction
+from .common import PositionLedger, get_metadata, get_price_matrix
+from .models import Asset, Portfolio, Transaction
 
 
 class UploadFileForm(forms.Form):
@@ -13,22 +15,87 @@ class UploadFileForm(forms.Form):
         return file
 
 
+# Shared with the batch import so both report the same errors
+TRANSACTION_ERRORS = {
+    "same_asset": "El activo a comprar no puede ser el mismo que el activo a vender.",
+    "not_held": "El activo seleccionado no está disponible en el portafolio.",
+    "no_price": "No hay precio disponible para el activo seleccionado en la fecha proporcionada.",
+    "too_much": "No puedes vender más de {value} del activo seleccionado.",
+}
+
+
+class CachedChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for instance in self.field.instances():
+            yield self.choice(instance)
+
+    def __len__(self):
+        return len(self.field.instances()) + (self.field.empty_label is not None)
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField over the instances returned by instances, which come
+    from the cached metadata: rendering and cleaning it takes no query.
+    The queryset only describes the model.
+    """
+
+    iterator = CachedChoiceIterator
+
+    def __init__(self, instances, queryset, **kwargs):
+        self.instances = instances
+        super().__init__(queryset=queryset, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        self.validate_no_null_characters(value)
+        by_pk = {str(instance.pk): instance for instance in self.instances()}
+        instance = by_pk.get(str(getattr(value, "pk", value)))
+        if instance is None:
+            raise forms.ValidationError(
+                self.error_messages["invalid_choice"],
+                code="invalid_choice",
+                params={"value": value},
+            )
+        return instance
+
+
 class TransactionForm(forms.ModelForm):
     class Meta:
         model = Transaction
         fields = ["date", "value", "portfolio"]
 
-    portfolio = forms.ModelChoiceField(
-        queryset=Portfolio.objects.all(), empty_label="Seleccione un portafolio"
+    portfolio = CachedModelChoiceField(
+        lambda: get_metadata().portfolio_choices,
+        queryset=Portfolio.objects.all(),
+        empty_label="Seleccione un portafolio",
     )
-    asset_to_sell = forms.ModelChoiceField(
-        queryset=Asset.objects.all(), empty_label="Seleccione un activo a vender"
+    asset_to_sell = CachedModelChoiceField(
+        lambda: get_metadata().asset_choices,
+        queryset=Asset.objects.all(),
+        empty_label="Seleccione un activo a vender",
     )
-    asset_to_buy = forms.ModelChoiceField(
-        queryset=Asset.objects.all(), empty_label="Seleccione un activo a comprar"
+    asset_to_buy = CachedModelChoiceField(
+        lambda: get_metadata().asset_choices,
+        queryset=Asset.objects.all(),
+        empty_label="Seleccione un activo a comprar",
     )
     date = forms.DateField(widget=forms.DateInput(attrs={"type": "date"}))
-    value = forms.DecimalField(min_value=0, required=False, label="Cantidad")
+    value = forms.DecimalField(min_value=0, label="Cantidad")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The three choice fields share one metadata lookup and its version query
+        metadata = get_metadata()
+        for name, instances in (
+            ("portfolio", metadata.portfolio_choices),
+            ("asset_to_sell", metadata.asset_choices),
+            ("asset_to_buy", metadata.asset_choices),
+        ):
+            self.fields[name].instances = lambda instances=instances: instances
 
     def clean(self):
         cleaned_data = super().clean()
@@ -39,53 +106,50 @@ class TransactionForm(forms.ModelForm):
         value = cleaned_data.get("value")
 
         if asset_to_buy == asset_to_sell:
-            self.add_error(
-                "asset_to_buy",
-                "El activo a comprar no puede ser el mismo que el activo a vender.",
-            )
+            self.add_error("asset_to_buy", TRANSACTION_ERRORS["same_asset"])
+
+        prices = get_price_matrix()
+        price_to_sell = (
+            prices.get(asset_to_sell.name, date) if date and asset_to_sell else None
+        )
+        price_to_buy = (
+            prices.get(asset_to_buy.name, date) if date and asset_to_buy else None
+        )
 
-        if portfolio and asset_to_sell and value:
-            try:
-                tick = Tick.objects.get(portfolio=portfolio, asset=asset_to_sell)
-                price = Price.objects.get(asset=asset_to_sell, date=date)
-                tick_value = tick.quantity * price.value
-                if value > tick_value:
+        if portfolio and asset_to_sell and value and price_to_sell is not None:
+            # Position on that date after every earlier transaction, from
+            # the positions of that asset alone loaded in one query
+            ledger = PositionLedger.load([portfolio.pk], [asset_to_sell.pk])
+            quantity = ledger.available(portfolio.pk, asset_to_sell.pk, date)
+            if quantity is None:
+                self.add_error("asset_to_sell", TRANSACTION_ERRORS["not_held"])
+            else:
+                available_value = quantity * price_to_sell
+                if value > available_value:
                     self.add_error(
                         "value",
-                        f"No puedes vender más de {round(tick_value, 2)} del activo seleccionado.",
+                        TRANSACTION_ERRORS["too_much"].format(
+                            value=round(available_value, 2)
+                        ),
                     )
 
-            except Tick.DoesNotExist:
-                self.add_error(
-                    "asset_to_sell",
-                    "El activo seleccionado no está disponible en el portafolio.",
-                )
-
         if date and asset_to_sell:
-            try:
-                price_to_sell = Price.objects.get(asset=asset_to_sell, date=date)
+            if price_to_sell is None:
+                self.add_error("asset_to_sell", TRANSACTION_ERRORS["no_price"])
+            elif value is not None:
                 cleaned_data["quantity_to_sell"] = self.calculate_quantity(
-                    value, price_to_sell.value
-                )
-                cleaned_data["price_to_sell"] = price_to_sell.value
-            except Price.DoesNotExist:
-                self.add_error(
-                    "asset_to_sell",
-                    "No hay precio disponible para el activo seleccionado en la fecha proporcionada.",
+                    value, price_to_sell
                 )
+                cleaned_data["price_to_sell"] = price_to_sell
 
         if date and asset_to_buy:
-            try:
-                price_to_buy = Price.objects.get(asset=asset_to_buy, date=date)
+            if price_to_buy is None:
+                self.add_error("asset_to_buy", TRANSACTION_ERRORS["no_price"])
+            elif value is not None:
                 cleaned_data["quantity_to_buy"] = self.calculate_quantity(
-                    value, price_to_buy.value
-                )
-                cleaned_data["price_to_buy"] = price_to_buy.value
-            except Price.DoesNotExist:
-                self.add_error(
-                    "asset_to_buy",
-                    "No hay precio disponible para el activo seleccionado en la fecha proporcionada.",
+                    value, price_to_buy
                 )
+                cleaned_data["price_to_buy"] = price_to_buy
 
         return cleaned_data
 
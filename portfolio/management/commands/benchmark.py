@@ -0,0 +1,205 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+import pandas as pd
+
+from portfolio.common import (
+    append_price_days,
+    build_workbook,
+    comparation_plot,
+    compute_many,
+    create_transactions,
+    empty_quantity_deltas,
+    get_price_matrix,
+    invalidate_price_matrix,
+    load_initial_quantities_many,
+    load_quantity_deltas_many,
+    rebuild_positions,
+    refresh_snapshots,
+)
+from portfolio.forms import TransactionForm
+from portfolio.models import Asset, Portfolio
+from portfolio.services import (
+    INITIAL_DATE,
+    FileUploadServices,
+    get_data_in_range,
+    get_portfolio_series,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the upload, range query, plotting and transaction validation "
+        "paths on synthetic data and print the results as JSON. Everything "
+        "runs inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--assets", type=int, default=20)
+        parser.add_argument("--days", type=int, default=500)
+        parser.add_argument("--portfolios", type=int, default=2)
+        parser.add_argument(
+            "--transactions",
+            type=int,
+            default=100,
+            help="Number of sell/buy pairs created before the range queries",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--workers",
+            default="1",
+            help="Comma separated process counts to time the valuation of every "
+            "portfolio over the whole range with, e.g. 1,2,4",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the JSON results to this file")
+
+    def timed(self, function, repeat):
+        durations = []
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            durations.append((time.perf_counter() - start) * 1000)
+        return result, {
+            "runs": repeat,
+            "mean_ms": round(statistics.mean(durations), 3),
+            "min_ms": round(min(durations), 3),
+            "max_ms": round(max(durations), 3),
+        }
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "HEAD"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def run_cases(self, options):
+        repeat = options["repeat"]
+        results = {}
+        workbook = build_workbook(
+            options["assets"],
+            options["days"],
+            options["portfolios"],
+            INITIAL_DATE,
+            seed=options["seed"],
+        ).getvalue()
+
+        extended = append_price_days(workbook, 1, seed=options["seed"]).getvalue()
+
+        def upload(content, incremental=True):
+            service = FileUploadServices(
+                SimpleUploadedFile("synthetic.xlsx", content), incremental=incremental
+            )
+            success, error = service.create()
+            if not success:
+                raise CommandError(error)
+            return service.stats
+
+        stats, results["upload"] = self.timed(
+            lambda: upload(workbook, incremental=False), 1
+        )
+        results["upload"]["rows"] = stats["prices"] + stats["ticks"]
+        results["upload"]["rows_per_second"] = round(
+            results["upload"]["rows"] / (results["upload"]["mean_ms"] / 1000), 1
+        )
+
+        # Prices changed inside this transaction, load them from the database
+        invalidate_price_matrix()
+        # The same workbook again, then with one more day of prices
+        _, results["reupload"] = self.timed(lambda: upload(workbook), 1)
+        _, results["append_day"] = self.timed(lambda: upload(extended), 1)
+        invalidate_price_matrix()
+        create_transactions(options["transactions"], seed=options["seed"])
+        rebuild_positions()
+        refresh_snapshots()
+
+        matrix = get_price_matrix()
+        start = matrix.min_date.strftime("%Y-%m-%d")
+        end = matrix.max_date.strftime("%Y-%m-%d")
+        data, results["get_data_in_range"] = self.timed(
+            lambda: get_data_in_range(start, end, 1), repeat
+        )
+        results["get_data_in_range"]["rows"] = len(data)
+
+        series = get_portfolio_series(start, end, 1)
+        _, results["comparation_plot"] = self.timed(
+            lambda: comparation_plot(series), repeat
+        )
+
+        results["valuation_scaling"] = self.scaling(matrix, options)
+
+        portfolio = Portfolio.objects.get(name="Portfolio 1")
+        assets = list(Asset.objects.order_by("id")[:2])
+        form_data = {
+            "portfolio": portfolio.id,
+            "date": start,
+            "asset_to_sell": assets[0].id,
+            "asset_to_buy": assets[1].id,
+            "value": "1000",
+        }
+        _, results["transaction_form"] = self.timed(
+            lambda: TransactionForm(form_data).is_valid(), repeat
+        )
+        return results
+
+    def scaling(self, matrix, options):
+        """
+        compute_many over every portfolio and the whole range for each of
+        the requested process counts.
+        """
+        portfolios = list(Portfolio.objects.all())
+        initial_quantities = load_initial_quantities_many(portfolios)
+        deltas = load_quantity_deltas_many(portfolios, matrix.max_date)
+        inputs = {
+            portfolio.pk: (
+                initial_quantities.get(portfolio.pk, pd.Series(dtype=float)),
+                deltas.get(portfolio.pk, empty_quantity_deltas()),
+            )
+            for portfolio in portfolios
+        }
+        dates = pd.date_range(matrix.min_date, matrix.max_date)
+
+        results = {"cpus": os.cpu_count()}
+        for workers in [int(count) for count in options["workers"].split(",")]:
+            # The first call of a size starts the pool, keep it out of the timing
+            compute_many(matrix, inputs, dates, workers, min_days=0)
+            _, results[str(workers)] = self.timed(
+                lambda: compute_many(matrix, inputs, dates, workers, min_days=0),
+                options["repeat"],
+            )
+        return results
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            results = self.run_cases(options)
+            transaction.set_rollback(True)
+        invalidate_price_matrix()
+
+        report = {
+            "commit": self.git_commit(),
+            "python": platform.python_version(),
+            "scale": {
+                key: options[key]
+                for key in ("assets", "days", "portfolios", "transactions")
+            },
+            "results": results,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as destination:
+                destination.write(output)
+        self.stdout.write(output)
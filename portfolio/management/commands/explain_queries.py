@@ -0,0 +1,95 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from portfolio.models import PortfolioSnapshot, Price, Tick, Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Show the query plan and latency of the hot query shapes with and "
+        "without the indexes declared in Meta.indexes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Times each query is run to measure its latency",
+        )
+
+    def query_shapes(self):
+        bounds = Price.objects.aggregate(min_date=Min("date"), max_date=Max("date"))
+        start = bounds["min_date"] or date.today()
+        end = bounds["max_date"] or date.today()
+        portfolio_id = Tick.objects.values_list("portfolio_id", flat=True).first() or 1
+        asset_ids = list(Price.objects.values_list("asset_id", flat=True)[:5])
+
+        return {
+            "transactions up to a date": Transaction.objects.filter(
+                portfolio_id=portfolio_id, date__lte=end
+            ).values_list("date", "asset__name", "quantity", "transaction_type"),
+            "initial ticks": Tick.objects.filter(portfolio_id=portfolio_id)
+            .order_by("date")
+            .values_list("asset__name", "quantity"),
+            "prices of a date": Price.objects.filter(
+                date=start, asset_id__in=asset_ids
+            ).values_list("asset_id", "value"),
+            "trading days": Price.objects.values("date")
+            .annotate(first_id=Min("date_id"), last_id=Max("date_id"))
+            .order_by("date"),
+            "prices by date_id": Price.objects.filter(
+                date_id__range=[0, 30]
+            ).values_list("date_id", "asset_id", "value"),
+            "snapshot range": PortfolioSnapshot.objects.filter(
+                portfolio_id=portfolio_id, date__range=[start, end]
+            )
+            .order_by("date")
+            .values_list("date", "value", "weights"),
+        }
+
+    def measure(self, queryset, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            list(queryset.all())
+        return (time.perf_counter() - start) / repeat * 1000
+
+    def report(self, repeat):
+        return {
+            name: (queryset.explain(), self.measure(queryset, repeat))
+            for name, queryset in self.query_shapes().items()
+        }
+
+    def handle(self, *args, **options):
+        repeat = options["repeat"]
+
+        # Drop the indexes inside a transaction that is rolled back afterwards
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for model in (Price, Tick, Transaction):
+                    for index in model._meta.indexes:
+                        cursor.execute(
+                            f"DROP INDEX {connection.ops.quote_name(index.name)}"
+                        )
+            before = self.report(repeat)
+            transaction.set_rollback(True)
+
+        # SQLite keeps the prepared plans of the connection, start a new one
+        connection.close()
+        after = self.report(repeat)
+
+        for name in after:
+            plan_before, ms_before = before[name]
+            plan_after, ms_after = after[name]
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f"  without indexes ({ms_before:.2f} ms)")
+            self.stdout.write(self._indent(plan_before))
+            self.stdout.write(f"  with indexes ({ms_after:.2f} ms)")
+            self.stdout.write(self._indent(plan_after))
+
+    def _indent(self, plan):
+        return "\n".join(f"    {line}" for line in plan.splitlines())
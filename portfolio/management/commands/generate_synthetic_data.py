@@ -0,0 +1,70 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+
+from portfolio.common import (
+    build_workbook,
+    create_transactions,
+    rebuild_positions,
+    refresh_snapshots,
+)
+from portfolio.services import INITIAL_DATE, FileUploadServices
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic workbook and optionally load it into the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--assets", type=int, default=20)
+        parser.add_argument("--days", type=int, default=500)
+        parser.add_argument("--portfolios", type=int, default=2)
+        parser.add_argument(
+            "--transactions",
+            type=int,
+            default=0,
+            help="Number of sell/buy pairs to create after loading",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--output", help="Path where the generated .xlsx workbook is written"
+        )
+        parser.add_argument(
+            "--load",
+            action="store_true",
+            help="Upload the workbook and create the transactions in the database",
+        )
+
+    def handle(self, *args, **options):
+        if not options["output"] and not options["load"]:
+            raise CommandError("Use --output, --load or both")
+
+        workbook = build_workbook(
+            options["assets"],
+            options["days"],
+            options["portfolios"],
+            INITIAL_DATE,
+            seed=options["seed"],
+        )
+
+        if options["output"]:
+            with open(options["output"], "wb") as destination:
+                destination.write(workbook.getvalue())
+            self.stdout.write(f"Workbook written to {options['output']}")
+
+        if not options["load"]:
+            return
+
+        service = FileUploadServices(
+            SimpleUploadedFile("synthetic.xlsx", workbook.getvalue())
+        )
+        success, error = service.create()
+        if not success:
+            raise CommandError(error)
+        self.stdout.write(f"Upload stored {service.stats}")
+
+        if options["transactions"]:
+            transactions = create_transactions(
+                options["transactions"], seed=options["seed"]
+            )
+            rebuild_positions()
+            refresh_snapshots()
+            self.stdout.write(f"{len(transactions)} transactions created")
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from portfolio.services import claim_upload_job, run_upload_job
+
+
+class Command(BaseCommand):
+    help = "Process the queued Excel uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when the queue is empty instead of waiting for new jobs",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=2.0,
+            help="Seconds to wait between polls of an empty queue",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_upload_job()
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(options["sleep"])
+                continue
+
+            self.stdout.write(f"Processing {job}")
+            job = run_upload_job(job)
+            if job.status == "done":
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"{job} - {job.rows_processed} rows, "
+                        f"{job.rows_per_second()} rows/s"
+                    )
+                )
+            else:
+                self.stdout.write(self.style.ERROR(f"{job} - {job.error}"))
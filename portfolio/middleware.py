@@ -0,0 +1,74 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .common import current_metrics, registry
+from .common.metrics import RequestMetrics, logger
+
+# Requests that match no URL (scanners, typos) share one entry, keying them
+# by path would grow the registry without limit
+UNRESOLVED_VIEW = "<unresolved>"
+
+
+class InstrumentationMiddleware:
+    """
+    Measure every request: SQL query count and time, Python time, timers
+    of the services and payload size. They are sent back in a Server-Timing
+    header, added to the totals served by /api/metrics/ and repeated
+    queries are logged as N+1 suspects.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        total_ms = metrics.elapsed_ms()
+        # Streamed bodies are still being produced, their size is unknown
+        size = None if response.streaming else len(response.content)
+
+        entries = [
+            f'db;dur={metrics.db_ms:.1f};desc="{metrics.queries} queries"',
+            f"py;dur={total_ms - metrics.db_ms:.1f}",
+            *(
+                f"{name};dur={duration:.1f}"
+                for name, duration in metrics.timers.items()
+            ),
+            f"total;dur={total_ms:.1f}",
+        ]
+        response["Server-Timing"] = ", ".join(entries)
+        if size is not None:
+            response["X-Payload-Bytes"] = str(size)
+
+        match = request.resolver_match
+        view = match.view_name if match else UNRESOLVED_VIEW
+        registry.record_request(view, metrics, total_ms, size)
+
+        for sql, count in metrics.repeated_statements():
+            logger.warning(
+                "Possible N+1 in %s: query run %s times: %s", view, count, sql
+            )
+        return response
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:21
+
+from django.core.files.base import ContentFile
+from django.db import migrations, models
+
+
+def move_content_to_files(apps, schema_editor):
+    """
+    Jobs still waiting keep their workbook as a file, the rest drop it.
+    """
+    UploadJob = apps.get_model("portfolio", "UploadJob")
+    for job in UploadJob.objects.filter(status__in=["pending", "running"]):
+        job.file.save(job.file_name, ContentFile(bytes(job.content)), save=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("portfolio", "0002_dataversion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="uploadjob",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="uploadjob",
+            name="file",
+            field=models.FileField(blank=True, upload_to="uploads/"),
+        ),
+        migrations.AddField(
+            model_name="uploadjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(move_content_to_files, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="uploadjob",
+            name="content",
+        ),
+    ]
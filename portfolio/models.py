@@ -1,5 +1,6 @@
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 
 
 class Asset(models.Model):
@@ -24,11 +25,15 @@ class Portfolio(models.Model):
 class Price(models.Model):
     asset = models.ForeignKey(Asset, on_delete=models.CASCADE)
     date = models.DateField()
-    date_id = models.IntegerField(blank=True, null=True)
+    date_id = models.IntegerField()
     value = models.DecimalField(max_digits=25, decimal_places=5)
 
     class Meta:
         unique_together = ("asset", "date")
+        indexes = [
+            models.Index(fields=["date_id", "asset"]),
+            models.Index(fields=["date", "asset"]),
+        ]
 
     def __str__(self):
         return f"{self.asset.name} - {self.date} - ${self.value}"
@@ -47,6 +52,7 @@ class Tick(models.Model):
 
     class Meta:
         unique_together = ("asset", "date", "portfolio")
+        indexes = [models.Index(fields=["portfolio", "date"])]
 
     def __str__(self):
         return (
@@ -72,9 +78,122 @@ class Transaction(models.Model):
     transaction_type = models.CharField(max_length=4, choices=TRANSACTION_TYPES)
     value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
 
+    class Meta:
+        indexes = [models.Index(fields=["portfolio", "date"])]
+
     def __str__(self):
         return f"{self.get_transaction_type_display()} de {self.asset.name}: {self.quantity} a un precio ${self.price} en {self.portfolio.name} el {self.date}"
 
     def clean(self):
         if self.quantity < 0:
             raise ValidationError("Quantity must be greater than 0")
+
+
+class Position(models.Model):
+    """
+    Quantity of an asset held by a portfolio from date until the next
+    position of the same asset, the initial ticks plus every transaction.
+    """
+
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE)
+    asset = models.ForeignKey(Asset, on_delete=models.CASCADE)
+    date = models.DateField()
+    quantity = models.DecimalField(max_digits=20, decimal_places=4)
+
+    class Meta:
+        unique_together = ("portfolio", "asset", "date")
+
+    def __str__(self):
+        return (
+            f"{self.portfolio.name} - {self.asset.name} - {self.quantity} - {self.date}"
+        )
+
+
+class PortfolioSnapshot(models.Model):
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE)
+    date = models.DateField()
+    value = models.DecimalField(max_digits=35, decimal_places=2)
+    weights = models.JSONField(default=dict)
+
+    class Meta:
+        unique_together = ("portfolio", "date")
+
+    def __str__(self):
+        return f"{self.portfolio.name} - {self.date} - ${self.value}"
+
+
+class UploadJob(models.Model):
+    STATUSES = [
+        ("pending", "Pendiente"),
+        ("running", "En proceso"),
+        ("done", "Completado"),
+        ("failed", "Fallido"),
+    ]
+    PHASES = [
+        ("assets", "Activos"),
+        ("portfolios", "Portafolios"),
+        ("prices", "Precios"),
+        ("ticks", "Ticks"),
+        ("snapshots", "Snapshots"),
+    ]
+
+    file_name = models.CharField(max_length=255)
+    # The workbook until the job finishes, removed afterwards
+    file = models.FileField(upload_to="uploads/", blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default="pending")
+    phase = models.CharField(max_length=10, choices=PHASES, blank=True)
+    rows_processed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # Last sign of life of the worker running the job
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    def __str__(self):
+        return f"Carga {self.id} - {self.file_name} - {self.get_status_display()}"
+
+    def rows_per_second(self):
+        if not self.started_at:
+            return 0
+        end = self.finished_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds()
+        return round(self.rows_processed / elapsed, 1) if elapsed > 0 else 0
+
+
+class UploadDigest(models.Model):
+    """
+    Hash of the last stored workbook (empty sheet) and of every column of
+    each block of rows of its sheets, so the next upload only writes what
+    changed.
+    """
+
+    sheet = models.CharField(max_length=100, blank=True)
+    block = models.PositiveIntegerField(default=0)
+    column = models.CharField(max_length=100, blank=True)
+    digest = models.CharField(max_length=64)
+
+    class Meta:
+        unique_together = ("sheet", "block", "column")
+
+    def __str__(self):
+        return f"{self.sheet or 'workbook'} - {self.block} - {self.column}"
+
+
+class DataVersion(models.Model):
+    """
+    Token of the current version of a set of data, like the prices or the
+    snapshots, replaced by a random one every time the data changes. Caches
+    key their entries with it. Unlike a counter kept in the cache it cannot
+    be evicted or start over at a value an old entry was stored with.
+    """
+
+    name = models.CharField(max_length=50, primary_key=True)
+    token = models.CharField(max_length=32)
+
+    def __str__(self):
+        return f"{self.name} - {self.token}"
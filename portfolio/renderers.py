@@ -0,0 +1,246 @@
+import abc
+import io
+import json
+from functools import wraps
+from itertools import chain, islice
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.request import Request
+
+from .common import PortfolioSeries, run_in_worker, timed
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+
+def is_batch(data):
+    """
+    Several series keyed by portfolio, as returned by the batch endpoint.
+    """
+    return (
+        isinstance(data, dict)
+        and len(data) > 0
+        and all(isinstance(series, PortfolioSeries) for series in data.values())
+    )
+
+
+class RecordsJSONRenderer(JSONRenderer):
+    """
+    One object per date with the weights keyed by asset, the default format.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, PortfolioSeries):
+            data = data.to_records()
+        elif is_batch(data):
+            data = {key: series.to_records() for key, series in data.items()}
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """
+    dates, values and assets as arrays and weights as one row per date, the
+    asset names are sent once instead of once per day.
+    """
+
+    media_type = "application/vnd.portfolio.columnar+json"
+    format = "columnar"
+
+    def columns(self, series):
+        return {
+            "portfolio": series.portfolio,
+            "dates": series.dates,
+            "values": series.values.tolist(),
+            "assets": series.assets,
+            "weights": series.weights.tolist(),
+        }
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, PortfolioSeries):
+            data = self.columns(data)
+        elif is_batch(data):
+            data = {key: self.columns(series) for key, series in data.items()}
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+# Records sent per chunk of a streamed response
+NDJSON_CHUNK_ROWS = 256
+
+
+def ndjson_chunks(data, chunk_rows=NDJSON_CHUNK_ROWS):
+    """
+    Records of one or several series as newline delimited JSON, a few
+    hundred lines per chunk. Anything else is a single line.
+    """
+    if isinstance(data, PortfolioSeries):
+        records = data.iter_records()
+    elif is_batch(data):
+        records = chain.from_iterable(series.iter_records() for series in data.values())
+    else:
+        records = iter([data])
+
+    while True:
+        chunk = list(islice(records, chunk_rows))
+        if not chunk:
+            return
+        yield "".join(
+            json.dumps(record, separators=(",", ":")) + "\n" for record in chunk
+        ).encode()
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    One JSON record per line. The views stream this format with
+    ndjson_chunks instead of rendering it, the renderer is used for errors
+    and makes the format negotiable.
+    """
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b"".join(ndjson_chunks(data))
+
+
+class ArrowTableRenderer(BaseRenderer, metaclass=abc.ABCMeta):
+    """
+    Series as an Arrow table with a date and a value column plus one weight
+    column per asset. Several series are stacked with a portfolio column
+    first, weights of assets a portfolio never held are null. Anything else,
+    like errors, is rendered as JSON.
+    """
+
+    charset = None
+    render_style = "binary"
+
+    def to_table(self, series):
+        columns = {
+            "date": pa.array(series.dates).cast(pa.date32()),
+            "value": pa.array(series.values, type=pa.float64()),
+        }
+        for position, asset in enumerate(series.assets):
+            columns[asset] = pa.array(series.weights[:, position], type=pa.float64())
+        return pa.table(columns, metadata={"portfolio": str(series.portfolio)})
+
+    def to_batch_table(self, batch):
+        tables = []
+        for key, series in batch.items():
+            table = self.to_table(series).replace_schema_metadata(None)
+            portfolio = pa.array([str(key)] * table.num_rows, type=pa.string())
+            tables.append(table.add_column(0, "portfolio", portfolio))
+        return pa.concat_tables(tables, promote_options="default")
+
+    @abc.abstractmethod
+    def write(self, table, sink):
+        """
+        Write table to the binary file-like sink in the format of the renderer.
+        """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if is_batch(data):
+            table = self.to_batch_table(data)
+        elif isinstance(data, PortfolioSeries):
+            table = self.to_table(data)
+        else:
+            response = (renderer_context or {}).get("response")
+            if response is not None:
+                response["Content-Type"] = "application/json"
+            return JSONRenderer().render(data)
+
+        sink = io.BytesIO()
+        self.write(table, sink)
+        return sink.getvalue()
+
+
+class ArrowStreamRenderer(ArrowTableRenderer):
+    media_type = "application/vnd.apache.arrow.stream"
+    format = "arrow"
+
+    def write(self, table, sink):
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+class ParquetRenderer(ArrowTableRenderer):
+    media_type = "application/vnd.apache.parquet"
+    format = "parquet"
+
+    def write(self, table, sink):
+        pq.write_table(table, sink)
+
+
+PORTFOLIO_DATA_RENDERERS = [RecordsJSONRenderer, ColumnarJSONRenderer, NDJSONRenderer]
+if pa is not None:
+    PORTFOLIO_DATA_RENDERERS += [ArrowStreamRenderer, ParquetRenderer]
+
+
+def async_api_view(renderer_classes):
+    """
+    GET only async counterpart of @api_view and @renderer_classes, DRF views
+    cannot be async. The renderer is negotiated before the view runs and
+    api_response renders with it.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != "GET":
+                return HttpResponseNotAllowed(["GET"])
+
+            renderers = [renderer() for renderer in renderer_classes]
+            try:
+                (
+                    request.accepted_renderer,
+                    request.accepted_media_type,
+                ) = DefaultContentNegotiation().select_renderer(
+                    Request(request), renderers
+                )
+            except NotAcceptable as e:
+                return JsonResponse({"detail": str(e.detail)}, status=406)
+            return await view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@timed("render")
+def api_response(request, data, status=200):
+    """
+    data rendered with the renderer negotiated by async_api_view.
+    """
+    renderer = request.accepted_renderer
+    response = HttpResponse(status=status, content_type=renderer.media_type)
+    response.content = renderer.render(
+        data, request.accepted_media_type, {"request": request, "response": response}
+    )
+    return response
+
+
+def ndjson_stream(request, data):
+    """
+    ndjson_chunks as the server streams it without buffering: a generator
+    under WSGI, an async iterator under ASGI which renders each chunk on the
+    worker pool instead of the event loop.
+    """
+    if isinstance(request, ASGIRequest):
+        return _ndjson_async_chunks(data)
+    return ndjson_chunks(data)
+
+
+async def _ndjson_async_chunks(data):
+    chunks = ndjson_chunks(data)
+    while True:
+        chunk = await run_in_worker(next, chunks, None)
+        if chunk is None:
+            return
+        yield chunk
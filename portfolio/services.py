@@ -1,10 +1,16 @@
+import logging
 import os
 import tempfile
-from datetime import date, datetime
-from decimal import Decimal
-from typing import Any, Dict, List, Optional, Tuple
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
 
 from rest_framework import status
 from rest_framework.decorators import api_view
@@ -13,47 +19,143 @@ from rest_framework.response import Response
 import pandas as pd
 
 from .common import (
+    QUANTITY_STEP,
+    WORKBOOK_KEY,
+    DigestKey,
+    PortfolioSeries,
+    PositionLedger,
+    PriceMatrix,
+    Resolution,
     calculate_actives_cuantity,
-    calculate_portfolio_value,
-    calculate_weights,
+    column_digests,
+    compute_many,
+    compute_portfolio_series,
+    concat_chunks,
+    decimal_places,
+    empty_quantity_deltas,
+    file_digest,
     get_minmax_range,
+    get_price_matrix,
+    invalidate_price_matrix,
+    load_digests,
+    load_initial_quantities,
+    load_initial_quantities_many,
+    load_price_frame,
+    load_quantity_deltas,
+    load_quantity_deltas_many,
+    load_snapshot_series,
+    load_snapshot_series_many,
+    open_workbook,
+    read_sheet,
+    rebuild_positions,
+    record_transactions,
+    refresh_snapshots,
+    renumber_trading_days,
+    resample_series,
+    save_digests,
+    stored_file_digest,
+    timed,
 )
-from .forms import TransactionForm
-from .models import Asset, Portfolio, Price, Tick, Transaction
+from .forms import TRANSACTION_ERRORS, TransactionForm
+from .models import (
+    Asset,
+    Portfolio,
+    PortfolioSnapshot,
+    Price,
+    Tick,
+    Transaction,
+    UploadJob,
+)
+
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = 2000
+INITIAL_DATE = date(2022, 2, 15)
+# Rows accepted by one request to the transaction import API
+TRANSACTION_IMPORT_LIMIT = 5000
+# A running upload job without progress for this long lost its worker
+UPLOAD_JOB_STALE_SECONDS = getattr(settings, "UPLOAD_JOB_STALE_SECONDS", 900)
+# Claims of a job before it is failed instead of requeued again
+UPLOAD_JOB_MAX_ATTEMPTS = getattr(settings, "UPLOAD_JOB_MAX_ATTEMPTS", 3)
 
 
 class FileUploadServices:
-    def __init__(self, file_obj: Any) -> None:
+    def __init__(
+        self,
+        file_obj: Any,
+        bulk: bool = True,
+        progress: Optional[Callable[[str, int], None]] = None,
+        incremental: bool = True,
+    ) -> None:
         self.file_obj = file_obj
-        self.temp_dir = tempfile.gettempdir()
-        self.file_path = os.path.join(self.temp_dir, "uploaded_file.xlsx")
-
-    def _save_temp_file(self) -> None:
-        with open(self.file_path, "wb+") as destination:
+        self.bulk = bulk
+        self.progress = progress
+        # Compare with the digests of the last upload and only write what
+        # changed, the bulk path only
+        self.incremental = incremental and bulk
+        self.stats: Dict[str, Any] = {}
+        self.rows_processed = 0
+        self.file_path: Optional[str] = None
+        self.previous: Dict[DigestKey, str] = {}
+        self.digests: Dict[DigestKey, str] = {}
+        # First date whose value changes, None when nothing was written
+        self.changed_from: Optional[date] = date.min
+        self.ticks_changed = True
+
+    def _report(self, phase: str, rows: int) -> None:
+        self.rows_processed += rows
+        if self.progress:
+            self.progress(phase, self.rows_processed)
+
+    def _workbook_source(self) -> Any:
+        """
+        Read the upload where Django already keeps it: the temporary file of
+        a TemporaryUploadedFile or the buffer of an InMemoryUploadedFile. Only
+        uploads that can not be read in place are copied to a temp file.
+        """
+        if hasattr(self.file_obj, "temporary_file_path"):
+            return self.file_obj.temporary_file_path()
+
+        buffer = getattr(self.file_obj, "file", self.file_obj)
+        if hasattr(buffer, "seekable") and buffer.seekable():
+            buffer.seek(0)
+            return buffer
+
+        return self._save_temp_file()
+
+    def _save_temp_file(self) -> str:
+        with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as destination:
             for chunk in self.file_obj.chunks():
                 destination.write(chunk)
+        self.file_path = destination.name
+        return self.file_path
+
+    def _remove_temp_file(self) -> None:
+        if self.file_path and os.path.exists(self.file_path):
+            os.remove(self.file_path)
+        self.file_path = None
 
     def _read_excel_file(
-        self,
+        self, workbook: Any
     ) -> Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame], Optional[str]]:
         try:
-            df_weights = pd.read_excel(self.file_path, sheet_name="weights")
-            df_prices = pd.read_excel(self.file_path, sheet_name="Precios")
+            df_weights = concat_chunks(*read_sheet(workbook, "weights"))
+            df_prices = concat_chunks(*read_sheet(workbook, "Precios"))
             df_prices.reset_index(drop=False, inplace=True)
             df_prices.rename(columns={"index": "date_id"}, inplace=True)
         except Exception as e:
-            print(f"Error reading the Excel file: {e}")
+            logger.exception("Error reading the Excel file")
             return None, None, str(f"Error reading the Excel file: {e}")
 
         return df_weights, df_prices, None
 
-    def _prepare_data(
-        self, df_weights: pd.DataFrame, df_prices: pd.DataFrame
-    ) -> Tuple[pd.DataFrame, pd.DataFrame, date]:
-        portfolio_columns = [col for col in df_weights.columns if "portafolio" in col]
-        portfolio_columns = {col: col.split(" ")[1] for col in portfolio_columns}
-        initial_date = datetime.strptime("2022-02-15", "%Y-%m-%d").date()
+    def _portfolio_columns(self, columns: List[str]) -> Dict[str, str]:
+        portfolio_columns = [col for col in columns if "portafolio" in col]
+        return {col: col.split(" ")[1] for col in portfolio_columns}
 
+    def _melt_weights(
+        self, df_weights: pd.DataFrame, portfolio_columns: Dict[str, str]
+    ) -> pd.DataFrame:
         df_weights = df_weights.melt(
             id_vars=["Fecha", "activos"],
             value_vars=[f"{portfolio}" for portfolio in portfolio_columns.keys()],
@@ -64,52 +166,445 @@ class FileUploadServices:
         df_weights["portafolio"] = df_weights["portafolio"].apply(
             lambda x: portfolio_columns[x]
         )
-        return df_weights, df_prices, initial_date
+        return df_weights
+
+    def _prepare_data(
+        self, df_weights: pd.DataFrame, df_prices: pd.DataFrame
+    ) -> Tuple[pd.DataFrame, pd.DataFrame, date]:
+        portfolio_columns = self._portfolio_columns(list(df_weights.columns))
+        df_weights = self._melt_weights(df_weights, portfolio_columns)
+        return df_weights, df_prices, INITIAL_DATE
+
+    def _upsert_rows(
+        self, df_weights: pd.DataFrame, df_prices: pd.DataFrame, initial_date: date
+    ) -> Dict[str, int]:
+        # Activos
+        assets = df_prices.columns[2:]
+        for asset_name in assets:
+            create_or_update_asset(asset_name)
+        self._report("assets", len(assets))
+
+        # Portafolios
+        portfolios = df_weights["portafolio"].unique()
+        for portafolio in portfolios:
+            create_or_update_portfolio(f"Portfolio {portafolio}")
+        self._report("portfolios", len(portfolios))
+
+        # Precios
+        for _, row in df_prices.iterrows():
+            date = row["Dates"].strftime("%Y-%m-%d")
+            date_id = row["date_id"]
+            for asset_name in assets:
+                price = row[asset_name]
+                create_or_update_price(asset_name, date, date_id, price)
+            self._report("prices", len(assets))
+
+        # Ticks
+        for _, row in df_weights.iterrows():
+            date = row["Fecha"].strftime("%Y-%m-%d")
+            asset_name = row["activos"]
+            portfolio_name = f"Portfolio {row['portafolio']}"
+            weight = float(row["weight"])
+            price = Price.objects.get(asset__name=asset_name, date=initial_date)
+            portafolio = Portfolio.objects.get(name=portfolio_name)
+            quantity = calculate_actives_cuantity(weight, price, portafolio)
+            create_or_update_tick(asset_name, portfolio_name, date, quantity, weight)
+            self._report("ticks", 1)
+
+        return {
+            "assets": len(assets),
+            "portfolios": len(portfolios),
+            "prices": len(df_prices) * len(assets),
+            "ticks": len(df_weights),
+        }
+
+    def _changed_columns(
+        self,
+        sheet: str,
+        block: int,
+        chunk: pd.DataFrame,
+        key_columns: List[str],
+        value_columns: Iterable[str],
+        context: str = "",
+    ) -> List[str]:
+        """
+        Value columns of the block whose digest differs from the last upload,
+        every digest is kept to be saved once the upload is stored.
+        """
+        current = column_digests(chunk, key_columns, value_columns, context)
+        changed = []
+        for column, digest in current.items():
+            self.digests[sheet, block, column] = digest
+            if self.previous.get((sheet, block, column)) != digest:
+                changed.append(column)
+        self.stats["unchanged_columns"] += len(current) - len(changed)
+        return changed
+
+    def _mark_changed(self, day: date) -> None:
+        self.changed_from = (
+            day if self.changed_from is None else min(self.changed_from, day)
+        )
+
+    @timed("upload_assets")
+    def _bulk_assets(self, assets: List[str]) -> Dict[str, int]:
+        Asset.objects.bulk_create(
+            [Asset(name=asset_name) for asset_name in assets], ignore_conflicts=True
+        )
+        return dict(Asset.objects.filter(name__in=assets).values_list("name", "id"))
+
+    @timed("upload_portfolios")
+    def _bulk_portfolios(self, portfolio_names: List[str]) -> Dict[str, Portfolio]:
+        Portfolio.objects.bulk_create(
+            [Portfolio(name=name) for name in portfolio_names], ignore_conflicts=True
+        )
+        return {
+            portfolio.name: portfolio
+            for portfolio in Portfolio.objects.filter(name__in=portfolio_names)
+        }
+
+    @timed("upload_prices")
+    def _bulk_prices(self, df_prices: pd.DataFrame, asset_ids: Dict[str, int]) -> int:
+        df_prices = df_prices.melt(
+            id_vars=["date_id", "Dates"],
+            value_vars=list(asset_ids.keys()),
+            var_name="asset",
+            value_name="value",
+        )
+        df_prices["value"] = pd.to_numeric(df_prices["value"])
+        df_prices = df_prices.dropna(subset=["value"])
+        if (df_prices["value"] < 0).any():
+            raise ValidationError("Price must be greater than 0")
+
+        prices = [
+            Price(
+                asset_id=asset_ids[asset_name], date=day, date_id=date_id, value=value
+            )
+            for date_id, day, asset_name, value in zip(
+                df_prices["date_id"].tolist(),
+                pd.to_datetime(df_prices["Dates"]).dt.date.tolist(),
+                df_prices["asset"].tolist(),
+                df_prices["value"].tolist(),
+            )
+        ]
+        Price.objects.bulk_create(
+            prices,
+            batch_size=BULK_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=["asset", "date"],
+            update_fields=["value", "date_id"],
+        )
+        return len(prices)
+
+    @timed("upload_ticks")
+    def _bulk_ticks(
+        self,
+        df_weights: pd.DataFrame,
+        asset_ids: Dict[str, int],
+        portfolios: Dict[str, Portfolio],
+        initial_prices: Dict[int, Decimal],
+    ) -> int:
+        ticks = []
+        for day, asset_name, portafolio, weight in zip(
+            pd.to_datetime(df_weights["Fecha"]).dt.date.tolist(),
+            df_weights["activos"].tolist(),
+            df_weights["portafolio"].tolist(),
+            df_weights["weight"].astype(float).tolist(),
+        ):
+            asset_id = asset_ids[asset_name]
+            portfolio = portfolios[f"Portfolio {portafolio}"]
+            if asset_id not in initial_prices:
+                raise Price.DoesNotExist(f"No price for {asset_name} on {INITIAL_DATE}")
+            quantity = (Decimal(weight) * portfolio.value) / initial_prices[asset_id]
+            if quantity < 0:
+                raise ValidationError("Quantity must be greater than 0")
+            ticks.append(
+                Tick(
+                    asset_id=asset_id,
+                    portfolio=portfolio,
+                    date=day,
+                    quantity=quantity,
+                    weight=weight,
+                )
+            )
+        Tick.objects.bulk_create(
+            ticks,
+            batch_size=BULK_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=["asset", "date", "portfolio"],
+            update_fields=["quantity", "weight"],
+        )
+        return len(ticks)
+
+    def _bulk_upsert(self, workbook: Any) -> Dict[str, int]:
+        """
+        Stream both sheets chunk by chunk, each chunk is written before the
+        next one is parsed. Only the columns of a chunk that changed since the
+        last upload are written.
+        """
+        if self.incremental:
+            self.previous = load_digests()
+        self.digests[WORKBOOK_KEY] = self.file_digest
+        self.changed_from, self.ticks_changed = None, False
+        self.stats = {"unchanged_columns": 0}
+
+        price_columns, price_chunks = read_sheet(workbook, "Precios")
+        weight_columns, weight_chunks = read_sheet(workbook, "weights")
+
+        # Activos
+        with transaction.atomic():
+            asset_ids = self._bulk_assets(price_columns[1:])
+        self._report("assets", len(asset_ids))
+
+        # Portafolios
+        portfolio_columns = self._portfolio_columns(weight_columns)
+        with transaction.atomic():
+            portfolios = self._bulk_portfolios(
+                [f"Portfolio {number}" for number in set(portfolio_columns.values())]
+            )
+        self._report("portfolios", len(portfolios))
+
+        # Precios
+        prices = written_prices = 0
+        for block, chunk in enumerate(price_chunks):
+            chunk.insert(0, "date_id", range(prices, prices + len(chunk)))
+            chunk.rename(columns={price_columns[0]: "Dates"}, inplace=True)
+            prices += len(chunk)
+            changed = self._changed_columns(
+                "Precios", block, chunk, ["date_id", "Dates"], asset_ids
+            )
+            if not changed:
+                continue
+            with transaction.atomic():
+                written = self._bulk_prices(
+                    chunk, {name: asset_ids[name] for name in changed}
+                )
+            self._mark_changed(pd.to_datetime(chunk["Dates"]).min().date())
+            written_prices += written
+            self._report("prices", written)
+
+        # Ticks
+        initial_prices = dict(
+            Price.objects.filter(
+                asset_id__in=asset_ids.values(), date=INITIAL_DATE
+            ).values_list("asset_id", "value")
+        )
+        # The quantities also depend on these, a change rewrites every tick
+        context = repr(
+            (
+                sorted(initial_prices.items()),
+                sorted(
+                    (name, portfolio.value) for name, portfolio in portfolios.items()
+                ),
+            )
+        )
+        ticks = 0
+        for block, chunk in enumerate(weight_chunks):
+            changed = self._changed_columns(
+                "weights",
+                block,
+                chunk,
+                ["Fecha", "activos"],
+                portfolio_columns,
+                context,
+            )
+            if not changed:
+                continue
+            df_weights = self._melt_weights(
+                chunk, {column: portfolio_columns[column] for column in changed}
+            )
+            with transaction.atomic():
+                written = self._bulk_ticks(
+                    df_weights, asset_ids, portfolios, initial_prices
+                )
+            self.ticks_changed = True
+            self._mark_changed(date.min)
+            ticks += written
+            self._report("ticks", written)
+
+        return {
+            **self.stats,
+            "assets": len(asset_ids),
+            "portfolios": len(portfolios),
+            "prices": written_prices,
+            "ticks": ticks,
+        }
 
     @transaction.atomic
     def create(self) -> Tuple[bool, Optional[str]]:
-        self._save_temp_file()
-        df_weights, df_prices, error = self._read_excel_file()
-        if error:
-            return False, error
-        df_weights, df_prices, initial_date = self._prepare_data(df_weights, df_prices)
+        return self.process()
+
+    def process(self) -> Tuple[bool, Optional[str]]:
+        """
+        Same as create but without the outer transaction, every chunk is
+        committed on its own so the progress of a background job is visible
+        to other connections while it runs.
+        """
+        self.file_digest = file_digest(self.file_obj)
+        if self.incremental and self.file_digest == stored_file_digest():
+            self.stats = {"unchanged_file": True}
+            logger.info("Upload skipped, same workbook as the last one")
+            return True, None
+
         try:
-            # Activos
-            assets = df_prices.columns[2:]
-            for asset_name in assets:
-                create_or_update_asset(asset_name)
-
-            # Portafolios
-            for portafolio in df_weights["portafolio"].unique():
-                create_or_update_portfolio(f"Portfolio {portafolio}")
-
-            # Precios
-            for _, row in df_prices.iterrows():
-                date = row["Dates"].strftime("%Y-%m-%d")
-                date_id = row["date_id"]
-                for asset_name in assets:
-                    price = row[asset_name]
-                    create_or_update_price(asset_name, date, date_id, price)
-
-            # Ticks
-            for _, row in df_weights.iterrows():
-                date = row["Fecha"].strftime("%Y-%m-%d")
-                asset_name = row["activos"]
-                portfolio_name = f"Portfolio {row['portafolio']}"
-                weight = float(row["weight"])
-                price = Price.objects.get(asset__name=asset_name, date=initial_date)
-                portafolio = Portfolio.objects.get(name=portfolio_name)
-                quantity = calculate_actives_cuantity(weight, price, portafolio)
-                create_or_update_tick(
-                    asset_name, portfolio_name, date, quantity, weight
-                )
+            workbook = open_workbook(self._workbook_source())
+        except Exception as e:
+            self._remove_temp_file()
+            logger.exception("Error reading the Excel file")
+            return False, str(f"Error reading the Excel file: {e}")
 
+        try:
+            if self.bulk:
+                return self._run(self._bulk_upsert, workbook)
+
+            df_weights, df_prices, error = self._read_excel_file(workbook)
+            if error:
+                return False, error
+            df_weights, df_prices, initial_date = self._prepare_data(
+                df_weights, df_prices
+            )
+            return self._run(self._upsert_rows, df_weights, df_prices, initial_date)
+        finally:
+            workbook.close()
+            self._remove_temp_file()
+
+    def _snapshots_from(self) -> Optional[date]:
+        """
+        First day to snapshot again: the first changed one, or the day after
+        the last snapshot when new dates were appended.
+        """
+        last = PortfolioSnapshot.objects.aggregate(last=Max("date"))["last"]
+        if last is None:
+            return None
+        return min(self.changed_from, last + timedelta(days=1))
+
+    def _updated_prices(self) -> PriceMatrix:
+        """
+        Price matrix with the prices just written, only the changed days are
+        read again when the earlier ones are untouched.
+        """
+        if self.changed_from == date.min:
+            return PriceMatrix.load()
+        return get_price_matrix().reload_since(self.changed_from)
+
+    def _run(self, upsert: Any, *args: Any) -> Tuple[bool, Optional[str]]:
+        start = time.perf_counter()
+        try:
+            self.stats = upsert(*args)
+            if self.changed_from is not None:
+                with transaction.atomic(), timed("upload_renumber"):
+                    renumber_trading_days()
+                # The cached matrix is only replaced once the new prices are
+                # committed
+                transaction.on_commit(invalidate_price_matrix)
+            with transaction.atomic():
+                if self.ticks_changed:
+                    with timed("upload_positions"):
+                        self.stats["positions"] = rebuild_positions()
+                if self.changed_from is not None:
+                    with timed("upload_snapshots"):
+                        self.stats["snapshots"] = refresh_snapshots(
+                            from_date=self._snapshots_from(),
+                            matrix=self._updated_prices(),
+                        )
+                    self._report("snapshots", self.stats["snapshots"])
+                save_digests(self.digests)
         except Exception as e:
+            logger.exception("Upload failed while storing the data")
             return False, f"Error creating the data: {e}"
 
+        self.stats["seconds"] = round(time.perf_counter() - start, 3)
+        logger.info("Upload stored %s", self.stats)
         return True, None
 
 
+def enqueue_upload(file_obj: Any) -> UploadJob:
+    """
+    Queue an uploaded workbook, written to the storage chunk by chunk.
+    """
+    return UploadJob.objects.create(file_name=file_obj.name, file=file_obj)
+
+
+def finish_upload_job(job: UploadJob, status: str, error: str = "") -> None:
+    """
+    Record how the job ended and remove its workbook.
+    """
+    job.file.delete(save=False)
+    UploadJob.objects.filter(id=job.id).update(
+        status=status, error=error, file="", finished_at=timezone.now()
+    )
+
+
+def requeue_stale_upload_jobs() -> int:
+    """
+    Put the running jobs whose worker stopped reporting back in the queue,
+    the ones already claimed UPLOAD_JOB_MAX_ATTEMPTS times fail instead.
+    Returns the number of jobs requeued.
+    """
+    stale = UploadJob.objects.filter(
+        status="running",
+        heartbeat_at__lt=timezone.now() - timedelta(seconds=UPLOAD_JOB_STALE_SECONDS),
+    )
+    for job in stale.filter(attempts__gte=UPLOAD_JOB_MAX_ATTEMPTS):
+        logger.warning("Upload job %s failed, its worker stopped", job.id)
+        finish_upload_job(job, "failed", "The worker stopped while processing it")
+    return stale.update(status="pending", phase="", rows_processed=0, started_at=None)
+
+
+def claim_upload_job() -> Optional[UploadJob]:
+    """
+    Take the oldest pending job, the conditional update makes sure only one
+    worker gets it.
+    """
+    requeue_stale_upload_jobs()
+    pending = UploadJob.objects.filter(status="pending").order_by("created_at")
+    for job_id in pending.values_list("id", flat=True)[:10]:
+        now = timezone.now()
+        claimed = UploadJob.objects.filter(id=job_id, status="pending").update(
+            status="running",
+            started_at=now,
+            heartbeat_at=now,
+            attempts=F("attempts") + 1,
+        )
+        if claimed:
+            return UploadJob.objects.get(id=job_id)
+    return None
+
+
+def run_upload_job(job: UploadJob) -> UploadJob:
+    def progress(phase: str, rows: int) -> None:
+        UploadJob.objects.filter(id=job.id).update(
+            phase=phase, rows_processed=rows, heartbeat_at=timezone.now()
+        )
+
+    try:
+        with job.file.open("rb"):
+            service = FileUploadServices(job.file, progress=progress)
+            success, error = service.process()
+    except Exception as e:
+        logger.exception("Upload job %s failed", job.id)
+        success, error = False, f"Error reading the Excel file: {e}"
+
+    finish_upload_job(job, "done" if success else "failed", error or "")
+    job.refresh_from_db()
+    return job
+
+
+def upload_job_status(job: UploadJob) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "file_name": job.file_name,
+        "status": job.status,
+        "phase": job.phase,
+        "rows_processed": job.rows_processed,
+        "rows_per_second": job.rows_per_second(),
+        "attempts": job.attempts,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
 def update_instance_fields(instance: Any, data: Dict[str, Any]) -> Any:
     """
     Update the instance with the given data only if the data has changed.
@@ -122,7 +617,9 @@ def update_instance_fields(instance: Any, data: Dict[str, Any]) -> Any:
         current_value = getattr(instance, field)
 
         if isinstance(current_value, Decimal):
-            new_value = Decimal(value).quantize(Decimal("0.01"))
+            # Compared at the precision the field stores
+            step = Decimal(1).scaleb(-decimal_places(type(instance), field))
+            new_value = Decimal(str(value)).quantize(step)
         else:
             new_value = value
 
@@ -183,43 +680,59 @@ def create_or_update_tick(
     return tick
 
 
+@transaction.atomic
+def save_transaction(cleaned_data: Dict[str, Any]) -> None:
+    """
+    Store the sell and buy transactions of a valid TransactionForm and move
+    the positions and snapshots they affect, all or nothing.
+    """
+    portfolio = cleaned_data["portfolio"]
+    date = cleaned_data["date"]
+    asset_to_sell = cleaned_data["asset_to_sell"]
+    asset_to_buy = cleaned_data["asset_to_buy"]
+    value = cleaned_data["value"]
+    quantity_to_sell = cleaned_data["quantity_to_sell"]
+    quantity_to_buy = cleaned_data["quantity_to_buy"]
+    price_to_sell = cleaned_data["price_to_sell"]
+    price_to_buy = cleaned_data["price_to_buy"]
+
+    # Create the sell transaction
+    sell, sell_created = Transaction.objects.get_or_create(
+        portfolio=portfolio,
+        date=date,
+        asset=asset_to_sell,
+        quantity=quantity_to_sell,
+        value=value,
+        price=price_to_sell,
+        transaction_type="sell",
+    )
+
+    # Create the buy transaction
+    buy, buy_created = Transaction.objects.get_or_create(
+        portfolio=portfolio,
+        date=date,
+        asset=asset_to_buy,
+        quantity=quantity_to_buy,
+        value=value,
+        price=price_to_buy,
+        transaction_type="buy",
+    )
+
+    record_transactions(
+        [
+            record
+            for record, created in ((sell, sell_created), (buy, buy_created))
+            if created
+        ]
+    )
+    refresh_snapshots([portfolio], date)
+
+
 @api_view(["POST"])
 def create_transaction_api(request: Any) -> Response:
     form = TransactionForm(request.data)
     if form.is_valid():
-        cleaned_data = form.cleaned_data
-        portfolio = cleaned_data["portfolio"]
-        date = cleaned_data["date"]
-        asset_to_sell = cleaned_data["asset_to_sell"]
-        asset_to_buy = cleaned_data["asset_to_buy"]
-        value = cleaned_data["value"]
-        quantity_to_sell = cleaned_data["quantity_to_sell"]
-        quantity_to_buy = cleaned_data["quantity_to_buy"]
-        price_to_sell = cleaned_data["price_to_sell"]
-        price_to_buy = cleaned_data["price_to_buy"]
-
-        # Create the sell transaction
-        Transaction.objects.get_or_create(
-            portfolio=portfolio,
-            date=date,
-            asset=asset_to_sell,
-            quantity=quantity_to_sell,
-            value=value,
-            price=price_to_sell,
-            transaction_type="sell",
-        )
-
-        # Create the buy transaction
-        Transaction.objects.get_or_create(
-            portfolio=portfolio,
-            date=date,
-            asset=asset_to_buy,
-            quantity=quantity_to_buy,
-            value=value,
-            price=price_to_buy,
-            transaction_type="buy",
-        )
-
+        save_transaction(form.cleaned_data)
         return Response(
             {"message": "Transaction created successfully"},
             status=status.HTTP_201_CREATED,
@@ -227,10 +740,137 @@ def create_transaction_api(request: Any) -> Response:
     return Response({"errors": form.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
+def _parse_row(
+    row: Dict[str, Any],
+    portfolios: Dict[int, Portfolio],
+    assets: Dict[int, Asset],
+    errors: Dict[str, List[str]],
+) -> Dict[str, Any]:
+    """
+    Fields of one import row converted like TransactionForm does, problems
+    are added to errors.
+    """
+    parsed: Dict[str, Any] = {}
+    for field, choices in (
+        ("portfolio", portfolios),
+        ("asset_to_sell", assets),
+        ("asset_to_buy", assets),
+    ):
+        try:
+            parsed[field] = choices[int(row.get(field))]
+        except (TypeError, ValueError, KeyError):
+            errors[field] = ["Seleccione una opción válida."]
+
+    try:
+        parsed["date"] = datetime.strptime(str(row.get("date")), "%Y-%m-%d").date()
+    except ValueError:
+        errors["date"] = ["Ingrese una fecha válida (YYYY-MM-DD)."]
+
+    try:
+        parsed["value"] = Decimal(str(row.get("value")))
+        if not parsed["value"].is_finite() or parsed["value"] <= 0:
+            raise InvalidOperation
+    except InvalidOperation:
+        errors["value"] = ["Ingrese un monto mayor a 0."]
+    return parsed
+
+
+def import_transactions(
+    rows: List[Dict[str, Any]],
+) -> Tuple[List[Transaction], List[Dict[str, Any]]]:
+    """
+    inputs:
+    - rows: sell/buy instructions with the fields of TransactionForm
+
+    output:
+    - transactions created, none when any row has errors
+    - errors: row number (from 1) and field errors of each invalid row
+
+    Every row is validated against the price matrix and the positions
+    loaded once, including the rows before it. The valid batch is written
+    with bulk_create in a single transaction.
+    """
+    portfolios = Portfolio.objects.in_bulk()
+    assets = Asset.objects.in_bulk()
+    matrix = get_price_matrix()
+    ledger = PositionLedger.load(portfolios)
+
+    transactions: List[Transaction] = []
+    errors: List[Dict[str, Any]] = []
+    for number, row in enumerate(rows, start=1):
+        row_errors: Dict[str, List[str]] = {}
+        parsed = _parse_row(row, portfolios, assets, row_errors)
+        if row_errors:
+            errors.append({"row": number, "errors": row_errors})
+            continue
+
+        portfolio, day, value = parsed["portfolio"], parsed["date"], parsed["value"]
+        asset_to_sell, asset_to_buy = parsed["asset_to_sell"], parsed["asset_to_buy"]
+        if asset_to_sell == asset_to_buy:
+            row_errors["asset_to_buy"] = [TRANSACTION_ERRORS["same_asset"]]
+
+        price_to_sell = matrix.get(asset_to_sell.name, day)
+        price_to_buy = matrix.get(asset_to_buy.name, day)
+        for field, price in (
+            ("asset_to_sell", price_to_sell),
+            ("asset_to_buy", price_to_buy),
+        ):
+            if price is None:
+                row_errors.setdefault(field, []).append(TRANSACTION_ERRORS["no_price"])
+
+        if price_to_sell is not None:
+            available = ledger.available(portfolio.pk, asset_to_sell.pk, day)
+            if available is None:
+                row_errors.setdefault("asset_to_sell", []).append(
+                    TRANSACTION_ERRORS["not_held"]
+                )
+            elif value > available * price_to_sell:
+                row_errors.setdefault("value", []).append(
+                    TRANSACTION_ERRORS["too_much"].format(
+                        value=round(available * price_to_sell, 2)
+                    )
+                )
+
+        if row_errors:
+            errors.append({"row": number, "errors": row_errors})
+            continue
+
+        for asset, price, transaction_type, sign in (
+            (asset_to_sell, price_to_sell, "sell", -1),
+            (asset_to_buy, price_to_buy, "buy", 1),
+        ):
+            quantity = (value / price).quantize(QUANTITY_STEP) if price else Decimal(0)
+            ledger.apply(portfolio.pk, asset.pk, day, sign * quantity)
+            transactions.append(
+                Transaction(
+                    portfolio=portfolio,
+                    asset=asset,
+                    date=day,
+                    price=price,
+                    quantity=quantity,
+                    value=value,
+                    transaction_type=transaction_type,
+                )
+            )
+
+    if errors or not transactions:
+        return [], errors
+
+    affected = {record.portfolio for record in transactions}
+    with transaction.atomic():
+        created = Transaction.objects.bulk_create(
+            transactions, batch_size=BULK_BATCH_SIZE
+        )
+        rebuild_positions(affected)
+        refresh_snapshots(affected, min(record.date for record in transactions))
+    return created, []
+
+
+@timed("series")
 @transaction.atomic
-def get_data_in_range(
+def get_portfolio_series(
     fecha_inicio: str, fecha_fin: str, portfolio_id: int
-) -> List[Dict[str, Any]]:
+) -> PortfolioSeries:
     """
     inputs:
     - start date
@@ -238,45 +878,111 @@ def get_data_in_range(
     - portfolio ID
 
     output:
-    - results: weights and values of the assets of the portfolio in the given range
+    - series: values and weights of the assets of the portfolio in the given range
     """
     portfolio = Portfolio.objects.get(name=f"Portfolio {portfolio_id}")
-    ticks = Tick.objects.filter(portfolio=portfolio)
-    transactions = Transaction.objects.filter(
-        portfolio=portfolio, date__range=[fecha_inicio, fecha_fin]
-    )
+    dates = pd.date_range(fecha_inicio, fecha_fin)
 
-    initial_quantities = {tick.asset: tick.quantity for tick in ticks}
-    result = []
+    snapshots = load_snapshot_series(
+        portfolio, dates[0].date(), dates[-1].date(), portfolio_id
+    )
+    if snapshots is not None:
+        return snapshots
 
-    for date_tp in pd.date_range(fecha_inicio, fecha_fin):
-        adjusted_quantities = initial_quantities.copy()
+    prices = load_price_frame(dates[0].date(), dates[-1].date())
+    initial_quantities = load_initial_quantities(portfolio)
+    deltas = load_quantity_deltas(portfolio, dates[-1].date())
 
-        for txn in transactions.filter(date__lte=date_tp):
-            if txn.transaction_type == "sell":
-                adjusted_quantities[txn.asset] -= txn.quantity
-            else:
-                adjusted_quantities[txn.asset] += txn.quantity
-        temp_ticks = []
+    values, weights = compute_portfolio_series(
+        prices, initial_quantities, deltas, dates
+    )
+    return PortfolioSeries.from_frames(portfolio_id, values, weights)
 
-        for asset, adjusted_quantity in adjusted_quantities.items():
-            tick = Tick(asset=asset, portfolio=portfolio, quantity=adjusted_quantity)
-            temp_ticks.append(tick)
 
-        prices = Price.objects.filter(date=date_tp)
-        portfolio_value = calculate_portfolio_value(temp_ticks, prices)
-        weights = calculate_weights(prices, temp_ticks, portfolio_value)
+@timed("series_batch")
+def get_portfolios_series(
+    fecha_inicio: str,
+    fecha_fin: str,
+    portfolio_ids: Optional[List[str]] = None,
+    resolution: Resolution = "daily",
+) -> Dict[str, PortfolioSeries]:
+    """
+    inputs:
+    - start date
+    - end date
+    - portfolio IDs, all the portfolios when None
+    - resolution of the series
 
-        result.append(
+    output:
+    - series of every portfolio keyed by its ID, the prices and the
+      transactions are read once for all of them
+    """
+    queryset = Portfolio.objects.all()
+    if portfolio_ids is not None:
+        names = {f"Portfolio {portfolio_id}" for portfolio_id in portfolio_ids}
+        queryset = queryset.filter(name__in=names)
+    # Keyed by the number in the name, "Portfolio 2" before "Portfolio 10"
+    portfolios = {
+        portfolio.name.removeprefix("Portfolio "): portfolio
+        for portfolio in sorted(queryset, key=lambda p: (len(p.name), p.name))
+    }
+    if portfolio_ids is not None:
+        missing = sorted(set(map(str, portfolio_ids)) - set(portfolios))
+        if missing:
+            raise Portfolio.DoesNotExist(f"Portfolios not found: {', '.join(missing)}")
+
+    dates = pd.date_range(fecha_inicio, fecha_fin)
+    start, end = dates[0].date(), dates[-1].date()
+
+    series = load_snapshot_series_many(portfolios, start, end)
+    pending = [portfolio for key, portfolio in portfolios.items() if key not in series]
+    matrix = get_price_matrix()
+    if pending:
+        initial_quantities = load_initial_quantities_many(pending)
+        deltas = load_quantity_deltas_many(pending, end)
+        computed = compute_many(
+            matrix,
             {
-                "date": date.strftime("%Y-%m-%d"),
-                "portfolio": portfolio_id,
-                "value": portfolio_value,
-                "weights": weights,
-            }
+                key: (
+                    initial_quantities.get(portfolio.pk, pd.Series(dtype=float)),
+                    deltas.get(portfolio.pk, empty_quantity_deltas()),
+                )
+                for key, portfolio in portfolios.items()
+                if key not in series
+            },
+            dates,
         )
+        for key, (values, weights) in computed.items():
+            series[key] = PortfolioSeries.from_frames(key, values, weights)
+
+    return {key: resample_series(series[key], resolution, matrix) for key in portfolios}
+
+
+def get_series_in_range(
+    fecha_inicio: str,
+    fecha_fin: str,
+    portfolio_id: int,
+    resolution: Resolution = "daily",
+) -> PortfolioSeries:
+    """
+    Same as get_portfolio_series at the given resolution.
+    """
+    series = get_portfolio_series(fecha_inicio, fecha_fin, portfolio_id)
+    return resample_series(series, resolution)
+
 
-    return result
+def get_data_in_range(
+    fecha_inicio: str,
+    fecha_fin: str,
+    portfolio_id: int,
+    resolution: Resolution = "daily",
+) -> List[Dict[str, Any]]:
+    """
+    Same as get_series_in_range, one dict per date.
+    """
+    return get_series_in_range(
+        fecha_inicio, fecha_fin, portfolio_id, resolution
+    ).to_records()
 
 
 def validate_date_range(
@@ -292,6 +998,12 @@ def validate_date_range(
     except ValueError:
         return False, "Invalid date format. Use YYYY-MM-DD."
 
+    if fecha_inicio_dt > fecha_fin_dt:
+        return (
+            False,
+            "Invalid date range. The start date must not be after the end date.",
+        )
+
     if fecha_inicio_dt < min_date_dt or fecha_fin_dt > max_date_dt:
         return (
             False,
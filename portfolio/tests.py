@@ -1 +1,1098 @@
-# Create your tests here.
+import json
+import os
+import pickle
+import random
+import tempfile
+from datetime import date, datetime, timedelta
+from decimal import ROUND_DOWN, Decimal
+from functools import partial, partialmethod
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock, skipIf
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+import numpy as np
+import pandas as pd
+from asgiref.sync import sync_to_async
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+from .common import (
+    CHART_POINTS,
+    PRICE_DECIMALS,
+    QUANTITY_DECIMALS,
+    QUANTITY_STEP,
+    RESOLUTIONS,
+    VALUE_DECIMALS,
+    PortfolioSeries,
+    PositionLedger,
+    PriceMatrix,
+    append_price_days,
+    build_workbook,
+    bump_snapshot_version,
+    cached_comparation_plot,
+    calculate_portfolio_value,
+    calculate_weights,
+    chart_cache,
+    compute_many,
+    create_transactions,
+    empty_quantity_deltas,
+    fixed_values,
+    from_fixed,
+    get_metadata,
+    get_price_matrix,
+    invalidate_price_matrix,
+    load_initial_quantities_many,
+    load_quantity_deltas_many,
+    lttb_indices,
+)
+from .common import metadata as metadata_module
+from .common import parse_resolution
+from .common import prices as prices_module
+from .common import (
+    read_sheet,
+    rebuild_positions,
+    record_transactions,
+    refresh_snapshots,
+    registry,
+    resample_series,
+    round_scaled,
+    to_fixed,
+    value_holdings,
+)
+from .common.metrics import RequestMetrics
+from .forms import TRANSACTION_ERRORS, TransactionForm
+from .middleware import UNRESOLVED_VIEW, InstrumentationMiddleware
+from .models import (
+    Asset,
+    DataVersion,
+    Portfolio,
+    PortfolioSnapshot,
+    Position,
+    Price,
+    Tick,
+    Transaction,
+    UploadDigest,
+    UploadJob,
+)
+from .renderers import ArrowStreamRenderer, ColumnarJSONRenderer, ParquetRenderer
+from .services import (
+    INITIAL_DATE,
+    UPLOAD_JOB_MAX_ATTEMPTS,
+    UPLOAD_JOB_STALE_SECONDS,
+    FileUploadServices,
+    claim_upload_job,
+    enqueue_upload,
+    get_data_in_range,
+    get_series_in_range,
+    import_transactions,
+    requeue_stale_upload_jobs,
+    run_upload_job,
+    save_transaction,
+    validate_date_range,
+)
+
+
+class Prices:
+    """
+    Stand-in for the Price queryset calculate_* look prices up in.
+    """
+
+    def __init__(self, prices):
+        self.prices = prices
+
+    def get(self, asset):
+        return SimpleNamespace(value=self.prices[asset.name])
+
+
+def random_decimal(rng, digits, decimals):
+    return Decimal(rng.randrange(10**digits)).scaleb(-decimals)
+
+
+class FixedPointValuationTests(SimpleTestCase):
+    def decimal_reference(self, prices, quantities):
+        assets = [SimpleNamespace(name=f"Asset {i}") for i in range(len(prices))]
+        records = [
+            SimpleNamespace(asset=asset, quantity=quantity)
+            for asset, quantity in zip(assets, quantities)
+        ]
+        lookup = Prices({asset.name: price for asset, price in zip(assets, prices)})
+        value = calculate_portfolio_value(records, lookup)
+        exact = sum(price * quantity for price, quantity in zip(prices, quantities))
+        weights = calculate_weights(lookup, records, exact) if exact else {}
+        return value, [weights.get(asset.name, 0) for asset in assets]
+
+    def assert_parity(self, prices, quantities):
+        expected_value, expected_weights = self.decimal_reference(prices, quantities)
+        prices = np.array([[float(price) for price in prices]])
+        quantities = np.array([[float(quantity) for quantity in quantities]])
+
+        fixed, _, _ = fixed_values(prices, quantities)
+        self.assertEqual(from_fixed(fixed, VALUE_DECIMALS), [expected_value])
+
+        values, weights = value_holdings(prices, quantities, "fixed")
+        self.assertEqual(values[0], float(expected_value))
+        for weight, expected in zip(weights[0], expected_weights):
+            self.assertAlmostEqual(weight, float(expected), places=12)
+
+    def test_parity_with_decimal_valuation(self):
+        rng = random.Random(22)
+        for _ in range(200):
+            assets = rng.randrange(1, 20)
+            self.assert_parity(
+                [random_decimal(rng, 10, PRICE_DECIMALS) for _ in range(assets)],
+                [random_decimal(rng, 12, QUANTITY_DECIMALS) for _ in range(assets)],
+            )
+
+    def test_half_cent_rounds_to_even(self):
+        # 1.00001 * 500 = 500.005 and 1.00003 * 500 = 500.015
+        self.assert_parity([Decimal("1.00001")], [Decimal("500.0000")])
+        self.assert_parity([Decimal("1.00003")], [Decimal("500.0000")])
+
+    def test_large_holdings_do_not_overflow(self):
+        self.assert_parity(
+            [Decimal("98765432.12345"), Decimal("12345678.98765")],
+            [Decimal("87654321.4321"), Decimal("-1234567.8901")],
+        )
+
+    def test_mode_is_read_from_the_settings(self):
+        # 1.00001 * 500 = 500.005, float64 rounds it up and fixed to even
+        prices, quantities = np.array([[1.00001]]), np.array([[500.0]])
+        for mode, expected in (("float", 500.01), ("fixed", 500.0)):
+            with override_settings(PORTFOLIO_VALUATION_MODE=mode):
+                values, _ = value_holdings(prices, quantities)
+            self.assertEqual(values[0], expected, msg=mode)
+
+        with override_settings(PORTFOLIO_VALUATION_MODE="decimal"):
+            with self.assertRaises(ValueError):
+                value_holdings(prices, quantities)
+
+    def test_process_pool_uses_the_mode_of_the_caller(self):
+        matrix = PriceMatrix(
+            np.array(["2024-01-02"], dtype="datetime64[D]"),
+            ["A"],
+            np.array([[1.00001]]),
+        )
+        inputs = {1: (pd.Series({"A": 500.0}), empty_quantity_deltas())}
+        dates = pd.date_range("2024-01-02", "2024-01-03")
+        for workers in (1, 2):
+            with override_settings(PORTFOLIO_VALUATION_MODE="fixed"):
+                results = compute_many(
+                    matrix, inputs, dates, workers=workers, min_days=0
+                )
+            self.assertEqual(results[1][0].tolist(), [500.0, 500.0], msg=workers)
+
+    def test_round_trip(self):
+        decimals = [Decimal("-12.34567"), Decimal("0.00001"), Decimal("1000000000")]
+        fixed = to_fixed(np.array(decimals, dtype=object), PRICE_DECIMALS)
+        self.assertEqual(from_fixed(fixed, PRICE_DECIMALS), decimals)
+        self.assertEqual(
+            to_fixed([float(d) for d in decimals], PRICE_DECIMALS).tolist(),
+            fixed.tolist(),
+        )
+
+    def test_round_scaled_negative(self):
+        self.assertEqual(
+            round_scaled(np.array([-15, -25, -26, 15, 25]), 1).tolist(),
+            [-2, -2, -3, 2, 2],
+        )
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class UploadedDataTestCase(TransactionTestCase):
+    """
+    Synthetic workbook uploaded before each test. New cache versions make
+    sure nothing cached by an earlier test is reused. The data is committed
+    so the async views can read it from their worker threads.
+    """
+
+    assets = 5
+    days = 40
+    portfolios = 2
+
+    def setUp(self):
+        invalidate_price_matrix()
+        bump_snapshot_version()
+        chart_cache.clear()
+        self.workbook = build_workbook(
+            self.assets, self.days, self.portfolios, INITIAL_DATE, seed=1
+        ).getvalue()
+        self.upload(self.workbook)
+
+    def upload(self, content, **kwargs):
+        service = FileUploadServices(
+            SimpleUploadedFile("synthetic.xlsx", content), **kwargs
+        )
+        success, error = service.process()
+        self.assertTrue(success, error)
+        return service.stats
+
+
+class CompareDataViewTests(UploadedDataTestCase):
+    def test_renders_the_plots(self):
+        matrix = get_price_matrix()
+        response = self.client.get(
+            reverse("compare_data"),
+            {
+                "portfolio": 1,
+                "fecha_inicio": str(matrix.min_date),
+                "fecha_fin": str(matrix.max_date),
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["value_plot"])
+        self.assertContains(response, "plotly")
+
+    def test_unknown_portfolio(self):
+        matrix = get_price_matrix()
+        response = self.client.get(
+            reverse("compare_data"),
+            {
+                "portfolio": 9999,
+                "fecha_inicio": str(matrix.min_date),
+                "fecha_fin": str(matrix.max_date),
+            },
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class NDJSONStreamTests(UploadedDataTestCase):
+    def params(self):
+        matrix = get_price_matrix()
+        return {
+            # The number in the portfolio name, as the views take it
+            "portfolio": 1,
+            "fecha_inicio": str(matrix.min_date),
+            "fecha_fin": str(matrix.max_date),
+        }
+
+    def assert_records(self, body, params):
+        lines = body.decode().splitlines()
+        first = datetime.strptime(params["fecha_inicio"], "%Y-%m-%d")
+        last = datetime.strptime(params["fecha_fin"], "%Y-%m-%d")
+        self.assertEqual(len(lines), (last - first).days + 1)
+        self.assertEqual(json.loads(lines[0])["date"], params["fecha_inicio"])
+
+    def test_sync_generator_under_wsgi(self):
+        params = self.params()
+        response = self.client.get(
+            reverse("portfolio_data"), params, HTTP_ACCEPT="application/x-ndjson"
+        )
+        self.assertFalse(response.is_async)
+        self.assert_records(b"".join(response.streaming_content), params)
+
+    async def test_async_iterator_under_asgi(self):
+        params = await sync_to_async(self.params)()
+        response = await self.async_client.get(
+            reverse("portfolio_data"), params, ACCEPT="application/x-ndjson"
+        )
+        self.assertTrue(response.is_async)
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        self.assert_records(body, params)
+
+
+class SaveTransactionTests(UploadedDataTestCase):
+    def test_rolls_back_when_the_snapshots_fail(self):
+        portfolio = Portfolio.objects.order_by("id").first()
+        asset_to_sell, asset_to_buy = Asset.objects.order_by("id")[:2]
+        cleaned_data = {
+            "portfolio": portfolio,
+            "date": get_price_matrix().max_date,
+            "asset_to_sell": asset_to_sell,
+            "asset_to_buy": asset_to_buy,
+            "value": Decimal("10"),
+            "quantity_to_sell": Decimal("1"),
+            "quantity_to_buy": Decimal("1"),
+            "price_to_sell": Decimal("10"),
+            "price_to_buy": Decimal("10"),
+        }
+        with mock.patch(
+            "portfolio.services.refresh_snapshots", side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                save_transaction(cleaned_data)
+        self.assertFalse(Transaction.objects.exists())
+
+
+class ComputeManyTests(UploadedDataTestCase):
+    def test_process_pool_matches_this_process(self):
+        matrix = get_price_matrix()
+        portfolios = list(Portfolio.objects.all())
+        initial_quantities = load_initial_quantities_many(portfolios)
+        deltas = load_quantity_deltas_many(portfolios, matrix.max_date)
+        inputs = {
+            portfolio.pk: (
+                initial_quantities.get(portfolio.pk, pd.Series(dtype=float)),
+                deltas.get(portfolio.pk, empty_quantity_deltas()),
+            )
+            for portfolio in portfolios
+        }
+        dates = pd.date_range(matrix.min_date, matrix.max_date)
+
+        expected = compute_many(matrix, inputs, dates, workers=1)
+        # Small shards so every portfolio is split over several tasks
+        pooled = compute_many(matrix, inputs, dates, 2, shard_days=7, min_days=0)
+        self.assertEqual(pooled.keys(), expected.keys())
+        for key, (values, weights) in expected.items():
+            pd.testing.assert_series_equal(pooled[key][0], values)
+            pd.testing.assert_frame_equal(pooled[key][1], weights)
+
+
+def edit_price(source, row, column, factor):
+    """
+    Copy of a workbook with one price of the "Precios" sheet scaled by factor.
+    """
+    sheets = pd.read_excel(BytesIO(source), sheet_name=None)
+    prices = sheets["Precios"]
+    prices.iloc[row, column] = round(prices.iloc[row, column] * factor, 4)
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        for name, sheet in sheets.items():
+            sheet.to_excel(writer, sheet_name=name, index=False)
+    return buffer.getvalue()
+
+
+class IncrementalUploadTests(UploadedDataTestCase):
+    def setUp(self):
+        # Blocks of 10 rows, so an edit in the middle leaves blocks untouched
+        patcher = mock.patch(
+            "portfolio.services.read_sheet", partial(read_sheet, chunk_rows=10)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def stored_data(self):
+        return {
+            "prices": list(
+                Price.objects.order_by("asset__name", "date").values_list(
+                    "asset__name", "date", "date_id", "value"
+                )
+            ),
+            "ticks": list(
+                Tick.objects.order_by("portfolio__name", "asset__name").values_list(
+                    "portfolio__name", "asset__name", "date", "quantity", "weight"
+                )
+            ),
+            "positions": list(
+                Position.objects.order_by(
+                    "portfolio__name", "asset__name", "date"
+                ).values_list("portfolio__name", "asset__name", "date", "quantity")
+            ),
+            "snapshots": list(
+                PortfolioSnapshot.objects.order_by(
+                    "portfolio__name", "date"
+                ).values_list("portfolio__name", "date", "value", "weights")
+            ),
+        }
+
+    def test_matches_a_full_upload(self):
+        self.assertEqual(self.upload(self.workbook), {"unchanged_file": True})
+
+        edited = edit_price(self.workbook, row=15, column=2, factor=1.05)
+        edited = append_price_days(edited, 1).getvalue()
+        incremental = self.upload(edited)
+        self.assertGreater(incremental["unchanged_columns"], 0)
+        stored = self.stored_data()
+
+        Asset.objects.all().delete()
+        Portfolio.objects.all().delete()
+        UploadDigest.objects.all().delete()
+        invalidate_price_matrix()
+        bump_snapshot_version()
+        full = self.upload(edited, incremental=False)
+
+        self.assertLess(incremental["prices"], full["prices"])
+        self.assertEqual(len(stored["prices"]), self.assets * (self.days + 1))
+        self.assertEqual(stored, self.stored_data())
+
+
+class PositionLedgerTests(SimpleTestCase):
+    def test_available_with_back_dated_sells(self):
+        ledger = PositionLedger()
+        ledger.apply(1, 1, date(2024, 1, 1), Decimal("10"))
+        ledger.apply(1, 1, date(2024, 1, 10), Decimal("-8"))
+        self.assertIsNone(ledger.available(1, 1, date(2023, 12, 31)))
+        # Selling more on the 5th would leave the 10th negative
+        self.assertEqual(ledger.available(1, 1, date(2024, 1, 5)), Decimal("2"))
+
+        ledger.apply(1, 1, date(2024, 1, 3), Decimal("-1.5"))
+        self.assertEqual(ledger.held(1, 1, date(2024, 1, 3)), Decimal("8.5"))
+        self.assertEqual(ledger.available(1, 1, date(2024, 1, 2)), Decimal("0.5"))
+        self.assertEqual(ledger.available(1, 1, date(2024, 1, 10)), Decimal("0.5"))
+        self.assertEqual(ledger.available(1, 1, date(2024, 2, 1)), Decimal("0.5"))
+
+
+class RecordTransactionsTests(UploadedDataTestCase):
+    def stored_positions(self):
+        return list(
+            Position.objects.order_by("portfolio", "asset", "date").values_list(
+                "portfolio", "asset", "date", "quantity"
+            )
+        )
+
+    def test_matches_rebuild_positions(self):
+        portfolios = list(Portfolio.objects.values_list("id", flat=True))
+        ledger = PositionLedger.load(portfolios)
+        # Random days, so many trades land before ones already recorded
+        transactions = create_transactions(30, seed=19)
+        record_transactions(transactions)
+        for record in transactions:
+            delta = Decimal(record.quantity).quantize(QUANTITY_STEP)
+            if record.transaction_type == "sell":
+                delta = -delta
+            ledger.apply(record.portfolio_id, record.asset_id, record.date, delta)
+
+        recorded = self.stored_positions()
+        loaded = PositionLedger.load(portfolios)
+        self.assertEqual(ledger.dates, loaded.dates)
+        self.assertEqual(ledger.quantities, loaded.quantities)
+
+        rebuild_positions()
+        self.assertEqual(recorded, self.stored_positions())
+
+
+class ImportTransactionsTests(UploadedDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.portfolio = Portfolio.objects.order_by("id").first()
+        self.assets = list(Asset.objects.order_by("id")[:3])
+        self.day = get_price_matrix().max_date
+
+    def row(self, sell, buy, value, day=None):
+        return {
+            "portfolio": str(self.portfolio.pk),
+            "date": str(day or self.day),
+            "asset_to_sell": str(self.assets[sell].pk),
+            "asset_to_buy": str(self.assets[buy].pk),
+            "value": str(value),
+        }
+
+    def test_csv(self):
+        rows = [self.row(0, 1, 1000), self.row(1, 2, "250.5")]
+        content = "portfolio,date,asset_to_sell,asset_to_buy,value\n" + "".join(
+            ",".join(row.values()) + "\n" for row in rows
+        )
+        response = self.client.post(
+            reverse("import_transactions_api"), content, content_type="text/csv"
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json(), {"created": 4})
+        self.assertEqual(
+            sorted(Transaction.objects.values_list("transaction_type", "value")),
+            [
+                ("buy", Decimal("250.50")),
+                ("buy", Decimal("1000.00")),
+                ("sell", Decimal("250.50")),
+                ("sell", Decimal("1000.00")),
+            ],
+        )
+
+    def test_errors_are_numbered_by_row_and_nothing_is_written(self):
+        rows = [
+            self.row(0, 1, 1000),
+            {**self.row(0, 1, 1000), "date": "15/02/2022"},
+            self.row(2, 2, 1000),
+            {**self.row(0, 1, 1000), "value": "-5"},
+        ]
+        response = self.client.post(
+            reverse("import_transactions_api"), rows, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()["errors"]
+        self.assertEqual([error["row"] for error in errors], [2, 3, 4])
+        self.assertEqual(list(errors[0]["errors"]), ["date"])
+        self.assertEqual(
+            errors[1]["errors"], {"asset_to_buy": [TRANSACTION_ERRORS["same_asset"]]}
+        )
+        self.assertEqual(list(errors[2]["errors"]), ["value"])
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_later_rows_see_the_earlier_trades(self):
+        ledger = PositionLedger.load([self.portfolio.pk])
+        available = ledger.available(self.portfolio.pk, self.assets[0].pk, self.day)
+        price = get_price_matrix().get(self.assets[0].name, self.day)
+        everything = (available * price).quantize(Decimal("0.01"), ROUND_DOWN)
+
+        # Valid on its own, not once an earlier row sold everything held
+        created, errors = import_transactions([self.row(0, 2, 100)])
+        self.assertEqual(errors, [])
+        Transaction.objects.all().delete()
+        rebuild_positions()
+
+        created, errors = import_transactions(
+            [self.row(0, 1, everything), self.row(0, 2, 100)]
+        )
+        self.assertEqual(created, [])
+        self.assertEqual([error["row"] for error in errors], [2])
+        self.assertEqual(list(errors[0]["errors"]), ["value"])
+        self.assertFalse(Transaction.objects.exists())
+
+
+class DataInRangeTests(UploadedDataTestCase):
+    def per_day_records(self, fecha_inicio, fecha_fin, portfolio_id):
+        """
+        The per-day loop get_data_in_range used before the vectorized engine,
+        for the trading days where it found every price.
+        """
+        portfolio = Portfolio.objects.get(name=f"Portfolio {portfolio_id}")
+        initial_quantities = {
+            tick.asset: tick.quantity
+            for tick in Tick.objects.filter(portfolio=portfolio)
+        }
+        transactions = Transaction.objects.filter(
+            portfolio=portfolio, date__range=[fecha_inicio, fecha_fin]
+        )
+        result = []
+        for day in pd.date_range(fecha_inicio, fecha_fin):
+            prices = Price.objects.filter(date=day)
+            if not prices.exists():
+                continue
+            quantities = initial_quantities.copy()
+            for record in transactions.filter(date__lte=day):
+                if record.transaction_type == "sell":
+                    quantities[record.asset] -= record.quantity
+                else:
+                    quantities[record.asset] += record.quantity
+            ticks = [
+                Tick(asset=asset, portfolio=portfolio, quantity=quantity)
+                for asset, quantity in quantities.items()
+            ]
+            value = calculate_portfolio_value(ticks, prices)
+            result.append(
+                {
+                    "date": day.strftime("%Y-%m-%d"),
+                    "portfolio": portfolio_id,
+                    "value": value,
+                    "weights": calculate_weights(prices, ticks, value),
+                }
+            )
+        return result
+
+    def test_matches_the_per_day_loop(self):
+        create_transactions(20, seed=1)
+        rebuild_positions()
+        refresh_snapshots()
+        matrix = get_price_matrix()
+        fecha_inicio, fecha_fin = str(matrix.min_date), str(matrix.max_date)
+
+        expected = self.per_day_records(fecha_inicio, fecha_fin, "1")
+        records = {
+            record["date"]: record
+            for record in get_data_in_range(fecha_inicio, fecha_fin, "1")
+        }
+        self.assertEqual(len(expected), self.days)
+        for old in expected:
+            new = records[old["date"]]
+            self.assertEqual(new.keys(), old.keys())
+            self.assertEqual(new["portfolio"], old["portfolio"])
+            self.assertAlmostEqual(new["value"], float(old["value"]), delta=0.01)
+            self.assertEqual(new["weights"].keys(), old["weights"].keys())
+            for asset, weight in old["weights"].items():
+                self.assertAlmostEqual(new["weights"][asset], float(weight), places=9)
+
+    def test_reversed_range(self):
+        matrix = get_price_matrix()
+        fecha_inicio, fecha_fin = str(matrix.max_date), str(matrix.min_date)
+        is_valid, error = validate_date_range(fecha_inicio, fecha_fin)
+        self.assertFalse(is_valid)
+        self.assertIn("start date", error)
+
+        response = self.client.get(
+            reverse("portfolio_data"),
+            {"portfolio": 1, "fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": error})
+
+
+class UploadErrorTests(UploadedDataTestCase):
+    def test_unreadable_workbook_is_logged(self):
+        service = FileUploadServices(SimpleUploadedFile("broken.xlsx", b"not a zip"))
+        with self.assertLogs("portfolio.services", "ERROR") as logs:
+            success, error = service.process()
+        self.assertFalse(success)
+        self.assertTrue(error.startswith("Error reading the Excel file"))
+        self.assertIsNotNone(logs.records[0].exc_info)
+
+
+class MetadataTests(UploadedDataTestCase):
+    def test_summaries_render_like_portfolios(self):
+        metadata = get_metadata()
+        self.assertEqual(
+            [str(summary) for summary in metadata.portfolios],
+            [str(portfolio) for portfolio in Portfolio.objects.order_by("id")],
+        )
+        self.assertContains(
+            self.client.get(reverse("index")), str(metadata.portfolios[0])
+        )
+
+
+class ChartVersionTests(UploadedDataTestCase):
+    def render(self):
+        """
+        Plots of portfolio 1 over every priced day, counting the renders
+        that were not served from the chart cache.
+        """
+        matrix = get_price_matrix()
+        fecha_inicio, fecha_fin = str(matrix.min_date), str(matrix.max_date)
+
+        def load_series():
+            self.renders += 1
+            return get_series_in_range(fecha_inicio, fecha_fin, "1")
+
+        return cached_comparation_plot("1", fecha_inicio, fecha_fin, load_series)
+
+    def lose_versions(self):
+        cache.clear()
+        DataVersion.objects.all().delete()
+
+    def test_lost_version_does_not_revive_old_charts(self):
+        # Start over from fresh versions, as on a new server
+        self.lose_versions()
+        chart_cache.clear()
+        self.renders = 0
+        self.render()
+        self.render()
+        self.assertEqual(self.renders, 1)
+
+        create_transactions(10, seed=12)
+        rebuild_positions()
+        refresh_snapshots()
+        self.render()
+        self.assertEqual(self.renders, 2)
+
+        # The plots from before the transactions are not current again
+        self.lose_versions()
+        self.render()
+        self.assertEqual(self.renders, 3)
+
+
+class PriceVersionTests(UploadedDataTestCase):
+    def test_lost_version_does_not_revive_an_old_matrix(self):
+        cache.clear()
+        DataVersion.objects.all().delete()
+        old_matrix = get_price_matrix()
+        held = dict(prices_module._loaded)
+
+        self.upload(append_price_days(self.workbook, 1).getvalue())
+        # Another process still holds the old matrix when the cache loses
+        # everything
+        cache.clear()
+        prices_module._loaded.update(held)
+        self.assertGreater(get_price_matrix().max_date, old_matrix.max_date)
+
+    def test_lost_versions_do_not_revive_old_metadata(self):
+        cache.clear()
+        DataVersion.objects.all().delete()
+        old_metadata = get_metadata()
+        held = dict(metadata_module._loaded)
+
+        self.upload(append_price_days(self.workbook, 1).getvalue())
+        cache.clear()
+        metadata_module._loaded.update(held)
+        self.assertGreater(get_metadata().max_date, old_metadata.max_date)
+
+
+class PriceGapTests(SimpleTestCase):
+    """
+    Asset B has no price on the second trading day, its earlier price is
+    carried forward whichever day the range starts on.
+    """
+
+    def setUp(self):
+        self.matrix = PriceMatrix(
+            np.array(["2024-01-02", "2024-01-03", "2024-01-04"], dtype="datetime64[D]"),
+            ["A", "B"],
+            np.array([[10.0, 20.0], [10.0, np.nan], [10.0, 20.0]]),
+        )
+        self.inputs = {1: (pd.Series({"A": 1.0, "B": 1.0}), empty_quantity_deltas())}
+
+    def value_on(self, day, start, **kwargs):
+        dates = pd.date_range(start, "2024-01-04")
+        values, _ = compute_many(self.matrix, self.inputs, dates, **kwargs)[1]
+        return values[day]
+
+    def test_value_does_not_depend_on_the_start(self):
+        for start in ("2024-01-02", "2024-01-03"):
+            self.assertEqual(self.value_on("2024-01-03", start, workers=1), 30.0)
+
+    def test_process_pool_matches(self):
+        self.assertEqual(
+            self.value_on("2024-01-03", "2024-01-03", workers=2, min_days=0), 30.0
+        )
+
+    def test_raw_prices_keep_the_gap(self):
+        self.assertIsNone(self.matrix.get("B", date(2024, 1, 3)))
+        frame = self.matrix.frame(date(2024, 1, 3), date(2024, 1, 3))
+        self.assertEqual(frame["B"].iloc[-1], 20.0)
+        # The filled copy is not cached with the matrix, it is rebuilt
+        restored = pickle.loads(pickle.dumps(self.matrix))
+        self.assertNotIn("filled", restored.__dict__)
+        np.testing.assert_array_equal(restored.filled, self.matrix.filled)
+
+
+class UploadJobTests(UploadedDataTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        super().setUp()
+        self.updated = append_price_days(self.workbook, 1).getvalue()
+
+    def enqueue(self, content):
+        return enqueue_upload(SimpleUploadedFile("synthetic.xlsx", content))
+
+    def test_worker_runs_the_job_and_removes_the_workbook(self):
+        max_date = get_price_matrix().max_date
+        job = self.enqueue(self.updated)
+        path = job.file.path
+        with open(path, "rb") as stored:
+            self.assertEqual(stored.read(), self.updated)
+
+        claimed = claim_upload_job()
+        self.assertEqual((claimed.id, claimed.status), (job.id, "running"))
+        self.assertIsNone(claim_upload_job())
+
+        job = run_upload_job(claimed)
+        self.assertEqual(job.status, "done", job.error)
+        self.assertEqual(job.phase, "snapshots")
+        self.assertFalse(job.file)
+        self.assertFalse(os.path.exists(path))
+        # The appended day was stored
+        self.assertGreater(get_price_matrix().max_date, max_date)
+
+    def test_failed_job_removes_the_workbook(self):
+        job = self.enqueue(b"not a workbook")
+        path = job.file.path
+        with self.assertLogs("portfolio.services", "ERROR"):
+            job = run_upload_job(claim_upload_job())
+        self.assertEqual(job.status, "failed")
+        self.assertTrue(job.error.startswith("Error reading the Excel file"))
+        self.assertFalse(os.path.exists(path))
+
+    def test_stale_jobs_are_requeued_then_failed(self):
+        job = self.enqueue(self.updated)
+        stale = timezone.now() - timedelta(seconds=UPLOAD_JOB_STALE_SECONDS + 1)
+        for attempt in range(1, UPLOAD_JOB_MAX_ATTEMPTS + 1):
+            claimed = claim_upload_job()
+            self.assertEqual((claimed.id, claimed.attempts), (job.id, attempt))
+            # The worker dies without finishing the job
+            UploadJob.objects.filter(id=job.id).update(heartbeat_at=stale)
+
+        self.assertIsNone(claim_upload_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertFalse(job.file)
+
+    def test_running_job_is_not_requeued(self):
+        self.enqueue(self.updated)
+        claim_upload_job()
+        self.assertEqual(requeue_stale_upload_jobs(), 0)
+        self.assertIsNone(claim_upload_job())
+
+    def test_api_and_worker_command(self):
+        response = self.client.post(
+            reverse("upload_job_create_api"),
+            {"file": SimpleUploadedFile("synthetic.xlsx", self.updated)},
+        )
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["job_id"]
+        status_url = reverse("upload_job_api", args=[job_id])
+        self.assertEqual(self.client.get(status_url).json()["status"], "pending")
+
+        call_command("process_uploads", "--once", stdout=StringIO())
+        status = self.client.get(status_url).json()
+        self.assertEqual(status["status"], "done", status["error"])
+        self.assertEqual(status["attempts"], 1)
+        self.assertEqual(
+            self.client.get(reverse("upload_job_api", args=[0])).status_code, 404
+        )
+
+
+class InstrumentationMiddlewareTests(UploadedDataTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+        self.addCleanup(registry.clear)
+
+    def test_server_timing_and_payload_size(self):
+        response = self.client.get(reverse("index"))
+        self.assertEqual(response.status_code, 200)
+        names = [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+        self.assertEqual(names[:2], ["db", "py"])
+        self.assertEqual(names[-1], "total")
+        self.assertEqual(response["X-Payload-Bytes"], str(len(response.content)))
+
+        totals = registry.snapshot()["views"]["index"]
+        self.assertEqual(totals["count"], 1)
+        self.assertEqual(totals["bytes"], len(response.content))
+
+    def test_unresolved_requests_share_one_entry(self):
+        for path in ("/wp-login.php", "/.env", "/missing/1/"):
+            self.assertEqual(self.client.get(path).status_code, 404)
+
+        views = registry.snapshot()["views"]
+        self.assertEqual(list(views), [UNRESOLVED_VIEW])
+        self.assertEqual(views[UNRESOLVED_VIEW]["count"], 3)
+
+    def test_repeated_queries_are_logged(self):
+        def get_response(request):
+            for _ in range(3):
+                list(Asset.objects.filter(name="A1"))
+            return HttpResponse("ok")
+
+        middleware = InstrumentationMiddleware(get_response)
+        # Below the default threshold, lowered so a few queries are enough
+        lowered = partialmethod(RequestMetrics.repeated_statements, threshold=2)
+        with mock.patch.object(
+            RequestMetrics, "repeated_statements", lowered
+        ), self.assertLogs("portfolio.common.metrics", "WARNING") as logs:
+            response = middleware(RequestFactory().get("/"))
+
+        self.assertIn('desc="3 queries"', response["Server-Timing"])
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("query run 3 times", logs.output[0])
+
+
+class ResampleTests(SimpleTestCase):
+    """
+    Calendar series over the first quarter of 2024, prices only on weekdays
+    except Wednesday 31 January and Friday 29 March.
+    """
+
+    holidays = ["2024-01-31", "2024-03-29"]
+
+    def setUp(self):
+        days = pd.bdate_range("2024-01-01", "2024-03-31")
+        days = days[~days.isin(pd.to_datetime(self.holidays))]
+        self.matrix = PriceMatrix(
+            days.to_numpy().astype("datetime64[D]"), ["A"], np.ones((len(days), 1))
+        )
+        self.trading_days = list(days.strftime("%Y-%m-%d"))
+
+    def series(self, start="2024-01-01", end="2024-03-31"):
+        dates = pd.date_range(start, end)
+        return PortfolioSeries(
+            portfolio=1,
+            dates=list(dates.strftime("%Y-%m-%d")),
+            values=np.arange(len(dates), dtype=float),
+            assets=["A"],
+            weights=np.ones((len(dates), 1)),
+        )
+
+    def resample(self, resolution, **kwargs):
+        return resample_series(self.series(**kwargs), resolution, self.matrix)
+
+    def test_parse_resolution(self):
+        self.assertEqual(parse_resolution(None), "daily")
+        self.assertEqual(parse_resolution("", CHART_POINTS), CHART_POINTS)
+        for resolution in RESOLUTIONS:
+            self.assertEqual(parse_resolution(resolution), resolution)
+        self.assertEqual(parse_resolution("3"), 3)
+        self.assertEqual(parse_resolution("250"), 250)
+        for raw in ("2", "0", "-5", "1.5", " 10", "hourly", "Weekly"):
+            with self.assertRaises(ValueError, msg=raw):
+                parse_resolution(raw)
+
+    def test_daily_and_trading(self):
+        series = self.series()
+        self.assertIs(resample_series(series, "daily", self.matrix), series)
+        self.assertEqual(self.resample("trading").dates, self.trading_days)
+
+    def test_last_close_of_each_period(self):
+        self.assertEqual(
+            self.resample("monthly").dates,
+            ["2024-01-30", "2024-02-29", "2024-03-28"],
+        )
+        weekly = self.resample("weekly").dates
+        self.assertEqual(len(weekly), 13)
+        self.assertEqual(weekly[:2], ["2024-01-05", "2024-01-12"])
+        self.assertIn("2024-02-02", weekly)
+        self.assertEqual(weekly[-1], "2024-03-28")
+
+    def test_period_ending_on_the_last_trading_day(self):
+        # The range stops mid week and mid month, the last point is its end
+        for resolution in ("weekly", "monthly"):
+            dates = self.resample(resolution, end="2024-03-20").dates
+            self.assertEqual(dates[-1], "2024-03-20")
+        # Ending on a weekend keeps the Friday before it
+        self.assertEqual(
+            self.resample("weekly", end="2024-01-14").dates[-1], "2024-01-12"
+        )
+
+    def test_point_count_keeps_first_and_last(self):
+        for points in (3, 10, 50):
+            dates = self.resample(points).dates
+            self.assertEqual(len(dates), points)
+            self.assertEqual(dates[0], self.trading_days[0])
+            self.assertEqual(dates[-1], self.trading_days[-1])
+            self.assertEqual(dates, sorted(set(dates)))
+            self.assertTrue(set(dates) <= set(self.trading_days))
+
+        # More points than trading days keeps them all
+        self.assertEqual(self.resample(500).dates, self.trading_days)
+
+    def test_no_trading_days(self):
+        weekend = self.series("2024-01-06", "2024-01-07")
+        for resolution in ("trading", "weekly", "monthly", 10):
+            resampled = resample_series(weekend, resolution, self.matrix)
+            self.assertEqual(resampled.dates, [])
+            self.assertEqual(resampled.weights.shape, (0, 1))
+
+    def test_lttb_keeps_everything_under_the_threshold(self):
+        y = np.arange(5.0)
+        for threshold in (5, 6):
+            self.assertEqual(list(lttb_indices(y, y, threshold)), list(range(5)))
+
+    def test_lttb_bucket_edges(self):
+        # 31 points and 5 kept: buckets [1, 10), [10, 20) and [20, 30)
+        x = np.arange(31.0)
+        for spikes in ((1, 10, 20), (9, 19, 29)):
+            y = np.zeros(31)
+            y[list(spikes)] = [100, -100, 100]
+            self.assertEqual(list(lttb_indices(x, y, 5)), [0, *spikes, 30])
+
+
+class BatchDataTests(UploadedDataTestCase):
+    def get(self, portfolios="1,2", **headers):
+        matrix = get_price_matrix()
+        return self.client.get(
+            reverse("batch_portfolio_data"),
+            {
+                "portfolios": portfolios,
+                "fecha_inicio": str(matrix.min_date),
+                "fecha_fin": str(matrix.max_date),
+            },
+            headers=headers,
+        )
+
+    def columns(self):
+        response = self.get(accept=ColumnarJSONRenderer.media_type)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_records(self):
+        batch = self.get().json()
+        self.assertEqual(list(batch), ["1", "2"])
+        columns = self.columns()
+        for key, records in batch.items():
+            self.assertEqual(
+                [record["date"] for record in records], columns[key]["dates"]
+            )
+            self.assertEqual(
+                [record["value"] for record in records], columns[key]["values"]
+            )
+
+    def test_columnar(self):
+        columns = self.columns()
+        self.assertEqual(list(columns), ["1", "2"])
+        for key, series in columns.items():
+            self.assertEqual(series["portfolio"], key)
+            self.assertEqual(len(series["values"]), len(series["dates"]))
+            self.assertEqual(len(series["weights"]), len(series["dates"]))
+            self.assertEqual(len(series["weights"][0]), len(series["assets"]))
+
+    def assert_stacked(self, table):
+        """
+        One block of rows per portfolio under the portfolio column, the same
+        dates and values as the columnar format.
+        """
+        self.assertEqual(table.column_names[:3], ["portfolio", "date", "value"])
+        frame = table.to_pandas()
+        columns = self.columns()
+        self.assertEqual(list(frame["portfolio"].unique()), list(columns))
+        for key, rows in frame.groupby("portfolio", sort=False):
+            series = columns[key]
+            self.assertEqual(
+                [str(day) for day in rows["date"]], series["dates"], msg=key
+            )
+            self.assertEqual(rows["value"].tolist(), series["values"])
+            self.assertEqual(
+                rows[series["assets"]].to_numpy().tolist(), series["weights"]
+            )
+
+    @skipIf(pa is None, "pyarrow is not installed")
+    def test_arrow_stream(self):
+        response = self.get(accept=ArrowStreamRenderer.media_type)
+        self.assertEqual(response["Content-Type"], ArrowStreamRenderer.media_type)
+        self.assert_stacked(pa.ipc.open_stream(response.content).read_all())
+
+    @skipIf(pa is None, "pyarrow is not installed")
+    def test_parquet(self):
+        response = self.get(accept=ParquetRenderer.media_type)
+        self.assertEqual(response["Content-Type"], ParquetRenderer.media_type)
+        self.assert_stacked(pq.read_table(BytesIO(response.content)))
+
+    def test_all_portfolios(self):
+        self.assertEqual(list(self.get("all").json()), ["1", "2"])
+
+    def test_empty_portfolio_list(self):
+        for portfolios in ("", ",", " ", " , ,"):
+            response = self.get(portfolios)
+            self.assertEqual(response.status_code, 400, msg=repr(portfolios))
+            self.assertEqual(response.json(), {"error": "Missing parameters"})
+
+    def test_unknown_portfolio(self):
+        response = self.get("1,99")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {"error": "Portfolios not found: 99"})
+
+
+class TransactionFormTests(UploadedDataTestCase):
+    def data(self, **overrides):
+        portfolio = Portfolio.objects.order_by("id").first()
+        asset_to_sell, asset_to_buy = Asset.objects.order_by("id")[:2]
+        return {
+            "portfolio": portfolio.pk,
+            "date": str(get_price_matrix().max_date),
+            "asset_to_sell": asset_to_sell.pk,
+            "asset_to_buy": asset_to_buy.pk,
+            "value": "10",
+            **overrides,
+        }
+
+    def test_valid_form_queries(self):
+        data = self.data()
+        get_metadata()
+        # With the metadata and the prices cached: their versions, the
+        # positions of the asset sold and the portfolio foreign key check
+        with self.assertNumQueries(4):
+            form = TransactionForm(data)
+            self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(
+            form.cleaned_data["quantity_to_sell"],
+            Decimal("10") / form.cleaned_data["price_to_sell"],
+        )
+
+    def test_missing_value(self):
+        for value in ("", None):
+            data = self.data(value=value)
+            if value is None:
+                del data["value"]
+            form = TransactionForm(data)
+            self.assertFalse(form.is_valid())
+            self.assertEqual(list(form.errors), ["value"])
+            self.assertNotIn("quantity_to_sell", form.cleaned_data)
+
+        response = self.client.post(reverse("create_transaction"), self.data(value=""))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Transaction.objects.exists())
@@ -1,14 +1,20 @@
 from django.urls import path
 
+from .services import create_transaction_api
 from .views import (
+    batch_data_in_range,
     compare_data,
     create_transaction,
-    create_transaction_api,
     data_in_range,
+    import_transactions_api,
     index,
+    metrics_api,
     reset_transactions,
     transaction_list,
     upload_file,
+    upload_job,
+    upload_job_api,
+    upload_job_create_api,
     upload_success,
 )
 
@@ -16,10 +22,24 @@ urlpatterns = [
     path("", index, name="index"),
     path("upload/", upload_file, name="upload_file"),
     path("upload/success/", upload_success, name="upload_success"),
+    path("upload/jobs/<int:job_id>/", upload_job, name="upload_job"),
     path("compare_data/", compare_data, name="compare_data"),
     path("api/portfolio-data/", data_in_range, name="portfolio_data"),
+    path(
+        "api/portfolio-data/batch/",
+        batch_data_in_range,
+        name="batch_portfolio_data",
+    ),
     path("transactions/", transaction_list, name="transactions"),
     path("transactions/new/", create_transaction, name="create_transaction"),
     path("transactions/reset/", reset_transactions, name="reset_transactions"),
     path("api/transactions/", create_transaction_api, name="create_transaction_api"),
+    path(
+        "api/transactions/import/",
+        import_transactions_api,
+        name="import_transactions_api",
+    ),
+    path("api/metrics/", metrics_api, name="metrics_api"),
+    path("api/upload-jobs/", upload_job_create_api, name="upload_job_create_api"),
+    path("api/upload-jobs/<int:job_id>/", upload_job_api, name="upload_job_api"),
 ]
@@ -1,41 +1,56 @@
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
-from django.shortcuts import redirect, render
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, parser_classes
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 
-import requests
-
-from .common import comparation_plot
+from .common import (
+    CHART_POINTS,
+    cached_comparation_plot,
+    get_metadata,
+    parse_resolution,
+    registry,
+    run_in_worker,
+)
 from .forms import TransactionForm, UploadFileForm
-from .models import Portfolio, Price, Transaction
+from .models import Portfolio, Transaction, UploadJob
+from .parsers import CSVParser
+from .renderers import (
+    PORTFOLIO_DATA_RENDERERS,
+    NDJSONRenderer,
+    api_response,
+    async_api_view,
+    ndjson_stream,
+)
 from .services import (
-    FileUploadServices,
-    create_transaction_api,
-    get_data_in_range,
-    get_minmax_range,
+    TRANSACTION_IMPORT_LIMIT,
+    enqueue_upload,
+    get_portfolio_series,
+    get_portfolios_series,
+    get_series_in_range,
+    import_transactions,
+    rebuild_positions,
+    refresh_snapshots,
+    save_transaction,
+    upload_job_status,
     validate_date_range,
 )
 
 
-def index(request):
-    have_Portfolio = Portfolio.objects.exists()
+async def index(request):
+    metadata = await run_in_worker(get_metadata)
     context = {}
 
-    if have_Portfolio:
-        Portfolios = Portfolio.objects.all()
-        for portfolio in Portfolios:
-            portfolio.value = round(portfolio.value, 1)
-        available_dates = Price.objects.values_list("date", flat=True).distinct()
-        min_date, max_date = get_minmax_range()
-
+    if metadata.portfolios:
         context = {
-            "Portfolios": Portfolios,
-            "available_dates": available_dates,
-            "min_date": min_date,
-            "max_date": max_date,
+            "Portfolios": metadata.portfolios,
+            "available_dates": metadata.trading_days,
+            "min_date": metadata.min_date,
+            "max_date": metadata.max_date,
         }
 
     return render(request, "portfolio/index.html", context)
@@ -45,13 +60,8 @@ def upload_file(request):
     if request.method == "POST":
         form = UploadFileForm(request.POST, request.FILES)
         if form.is_valid():
-            service = FileUploadServices(file_obj=request.FILES["file"])
-            success, error = service.create()
-            if success:
-                return HttpResponseRedirect(reverse("upload_success"))
-            else:
-                form.add_error(None, error)  # Add the error to the form
-                return render(request, "portfolio/upload.html", {"form": form})
+            job = enqueue_upload(request.FILES["file"])
+            return HttpResponseRedirect(reverse("upload_job", args=[job.id]))
     else:
         form = UploadFileForm()
     return render(request, "portfolio/upload.html", {"form": form})
@@ -61,38 +71,147 @@ def upload_success(request):
     return render(request, "portfolio/upload_success.html")
 
 
+def upload_job(request, job_id):
+    job = get_object_or_404(UploadJob, id=job_id)
+    return render(request, "portfolio/upload_job.html", {"job": job})
+
+
+@api_view(["POST"])
+def upload_job_create_api(request):
+    form = UploadFileForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return Response({"errors": form.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    job = enqueue_upload(request.FILES["file"])
+    return Response(
+        {"job_id": job.id, "status": job.status}, status=status.HTTP_202_ACCEPTED
+    )
+
+
 @api_view(["GET"])
-def data_in_range(request):
-    fecha_inicio = request.query_params.get("fecha_inicio")
-    fecha_fin = request.query_params.get("fecha_fin")
-    portfolio_id = request.query_params.get("portfolio")
+def upload_job_api(request, job_id):
+    try:
+        job = UploadJob.objects.get(id=job_id)
+    except UploadJob.DoesNotExist:
+        return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response(upload_job_status(job))
+
+
+async def series_response(request, series):
+    """
+    NDJSON is streamed a chunk at a time, the accepted renderer picks every
+    other format: records, columnar, Arrow, Parquet.
+    """
+    if isinstance(request.accepted_renderer, NDJSONRenderer):
+        return StreamingHttpResponse(
+            ndjson_stream(request, series), content_type=NDJSONRenderer.media_type
+        )
+    # Serializing a long range is as heavy as computing it
+    return await run_in_worker(api_response, request, series)
+
+
+@async_api_view(PORTFOLIO_DATA_RENDERERS)
+async def data_in_range(request):
+    fecha_inicio = request.GET.get("fecha_inicio")
+    fecha_fin = request.GET.get("fecha_fin")
+    portfolio_id = request.GET.get("portfolio")
+
+    if not fecha_inicio or not fecha_fin or not portfolio_id:
+        return api_response(
+            request, {"error": "Missing parameters"}, status=status.HTTP_400_BAD_REQUEST
+        )
 
-    is_valid, error_message = validate_date_range(fecha_inicio, fecha_fin)
+    is_valid, error_message = await run_in_worker(
+        validate_date_range, fecha_inicio, fecha_fin
+    )
     if not is_valid:
-        return Response(
+        return api_response(
+            request,
             {"error": error_message},
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    if not fecha_inicio or not fecha_fin or not portfolio_id:
-        return Response(
-            {"error": "Missing parameters"}, status=status.HTTP_400_BAD_REQUEST
+    try:
+        resolution = parse_resolution(request.GET.get("resolution"))
+    except ValueError as e:
+        return api_response(
+            request, {"error": str(e)}, status=status.HTTP_400_BAD_REQUEST
         )
 
     try:
-        result = get_data_in_range(fecha_inicio, fecha_fin, portfolio_id)
+        series = await run_in_worker(
+            get_series_in_range, fecha_inicio, fecha_fin, portfolio_id, resolution
+        )
     except Portfolio.DoesNotExist:
-        return Response(
-            {"error": "Portfolio not found"}, status=status.HTTP_404_NOT_FOUND
+        return api_response(
+            request, {"error": "Portfolio not found"}, status=status.HTTP_404_NOT_FOUND
+        )
+
+    except Exception as e:
+        return api_response(
+            request, {"error": str(e)}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return await series_response(request, series)
+
+
+@async_api_view(PORTFOLIO_DATA_RENDERERS)
+async def batch_data_in_range(request):
+    fecha_inicio = request.GET.get("fecha_inicio")
+    fecha_fin = request.GET.get("fecha_fin")
+    portfolios = request.GET.get("portfolios", "")
+
+    # "all" or a comma separated list of portfolio ids
+    portfolio_ids = None
+    if portfolios != "all":
+        portfolio_ids = [
+            portfolio_id.strip()
+            for portfolio_id in portfolios.split(",")
+            if portfolio_id.strip()
+        ]
+
+    # A list of only commas or blanks is as missing as no list
+    if not fecha_inicio or not fecha_fin or portfolio_ids == []:
+        return api_response(
+            request, {"error": "Missing parameters"}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    is_valid, error_message = await run_in_worker(
+        validate_date_range, fecha_inicio, fecha_fin
+    )
+    if not is_valid:
+        return api_response(
+            request,
+            {"error": error_message},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        resolution = parse_resolution(request.GET.get("resolution"))
+    except ValueError as e:
+        return api_response(
+            request, {"error": str(e)}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        series = await run_in_worker(
+            get_portfolios_series, fecha_inicio, fecha_fin, portfolio_ids, resolution
+        )
+    except Portfolio.DoesNotExist as e:
+        return api_response(
+            request, {"error": str(e)}, status=status.HTTP_404_NOT_FOUND
         )
 
     except Exception as e:
-        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return api_response(
+            request, {"error": str(e)}, status=status.HTTP_400_BAD_REQUEST
+        )
 
-    return JsonResponse(result, safe=False)
+    return await series_response(request, series)
 
 
-def compare_data(request):
+async def compare_data(request):
     fecha_inicio = request.GET.get("fecha_inicio")
     fecha_fin = request.GET.get("fecha_fin")
     portfolio_id = request.GET.get("portfolio")
@@ -100,21 +219,29 @@ def compare_data(request):
     if not fecha_inicio or not fecha_fin or not portfolio_id:
         return HttpResponse("Missing parameters", status=400)
 
-    response = requests.get(
-        request.build_absolute_uri("/api/portfolio-data/"),
-        params={
-            "fecha_inicio": fecha_inicio,
-            "fecha_fin": fecha_fin,
-            "portfolio": portfolio_id,
-        },
+    is_valid, error_message = await run_in_worker(
+        validate_date_range, fecha_inicio, fecha_fin
     )
+    if not is_valid:
+        return HttpResponse(error_message, status=400)
 
-    if response.status_code != 200:
-        return HttpResponse("Error fetching data", status=response.status_code)
-
-    data = response.json()
+    try:
+        resolution = parse_resolution(request.GET.get("resolution"), CHART_POINTS)
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
 
-    value_plot, weights_plot = comparation_plot(data)
+    try:
+        # Plotting is CPU bound, keep it off the event loop
+        value_plot, weights_plot = await run_in_worker(
+            cached_comparation_plot,
+            portfolio_id,
+            fecha_inicio,
+            fecha_fin,
+            lambda: get_portfolio_series(fecha_inicio, fecha_fin, portfolio_id),
+            resolution,
+        )
+    except Portfolio.DoesNotExist:
+        return HttpResponse("Portfolio not found", status=404)
 
     context = {
         "value_plot": value_plot,
@@ -126,28 +253,72 @@ def compare_data(request):
     return render(request, "portfolio/compare_data.html", context)
 
 
+@api_view(["POST"])
+@parser_classes([JSONParser, CSVParser])
+def import_transactions_api(request):
+    """
+    Many sell/buy pairs at once, as a JSON list (or {"transactions": [...]})
+    or a CSV with the columns portfolio, date, asset_to_sell, asset_to_buy
+    and value. Nothing is written unless every row is valid.
+    """
+    rows = request.data
+    if isinstance(rows, dict):
+        rows = rows.get("transactions")
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        return Response(
+            {"error": "Expected a list of transactions"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(rows) > TRANSACTION_IMPORT_LIMIT:
+        return Response(
+            {"error": f"At most {TRANSACTION_IMPORT_LIMIT} transactions per request"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    created, errors = import_transactions(rows)
+    if errors:
+        return Response({"errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({"created": len(created)}, status=status.HTTP_201_CREATED)
+
+
+@api_view(["GET"])
+def metrics_api(request):
+    """
+    Request and timer totals of this process, for local use only.
+    """
+    if not settings.DEBUG and request.META.get("REMOTE_ADDR") not in getattr(
+        settings, "INTERNAL_IPS", []
+    ):
+        return Response({"error": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
+    return Response(registry.snapshot())
+
+
 def reset_transactions(request):
     if request.method == "POST":
         Transaction.objects.all().delete()
+        rebuild_positions()
+        refresh_snapshots()
         return redirect(reverse("transactions"))
 
 
 def transaction_list(request):
-    transactions = Transaction.objects.all()
+    transactions = Transaction.objects.select_related("asset", "portfolio")
     return render(
         request, "portfolio/transaction_list.html", {"transactions": transactions}
     )
 
 
 def create_transaction(request):
-    min_date, max_date = get_minmax_range()
+    metadata = get_metadata()
+    min_date, max_date = metadata.min_date, metadata.max_date
 
     if request.method == "POST":
         form = TransactionForm(request.POST)
         if form.is_valid():
-            response = create_transaction_api(request)
-            if response.status_code == status.HTTP_201_CREATED:
-                return HttpResponseRedirect(reverse("transactions"))
+            # Saved from this form, the API would validate it all over again
+            save_transaction(form.cleaned_data)
+            return HttpResponseRedirect(reverse("transactions"))
     else:
         form = TransactionForm()
 